@@ -1,8 +1,13 @@
 import os
 import sys
+import io
+import csv
+import json
 import hashlib
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 
 # Get the DATABASE_URL from environment variables
@@ -15,19 +20,85 @@ print(f"Connecting to PostgreSQL database with URL: {DATABASE_URL}")
 
 # Import our models
 sys.path.append(os.path.abspath('.'))
-from create_tables import (
-    Base, Setting, HomeAssistantConfig, Entity, EntityState, 
-    Automation, Memory, Pattern
+from nexus.models import (
+    Setting, HomeAssistantConfig, Entity, EntityState, 
+    Automation, Memory, Pattern, create_db_engine
 )
 
-# Create engine and session
-engine = create_engine(DATABASE_URL)
+# Create engine and session (batch executemany calls into multi-row VALUES).
+# executemany_mode only exists on the psycopg2 dialect; psycopg 3 would reject it
+engine_options = {"insertmanyvalues_page_size": 1000}
+if make_url(os.environ.get("PGBOUNCER_URL") or DATABASE_URL).get_driver_name() == "psycopg2":
+    engine_options["executemany_mode"] = "values_plus_batch"
+engine = create_db_engine(DATABASE_URL, one_shot=True, **engine_options)
 Session = sessionmaker(bind=engine)
 session = Session()
 
+# Seed statements are built once at import; helpers only pass parameter lists
+_setting_insert = pg_insert(Setting)
+SETTING_UPSERT = _setting_insert.on_conflict_do_update(
+    index_elements=[Setting.key],
+    set_={"value": _setting_insert.excluded.value, "updated_at": func.now()}
+)
+ENTITY_INSERT = pg_insert(Entity).on_conflict_do_nothing(
+    index_elements=[Entity.entity_id]
+).returning(Entity.id, Entity.entity_id)
+ENTITY_STATE_INSERT = EntityState.__table__.insert()
+# Automation and pattern names are only unique in nexus/models.py; tables
+# created by the Flask app have no constraint for ON CONFLICT to target
+AUTOMATION_INSERT = Automation.__table__.insert()
+MEMORY_INSERT = pg_insert(Memory).on_conflict_do_nothing(index_elements=[Memory.key])
+PATTERN_INSERT = Pattern.__table__.insert()
+
 def hash_token(token):
-    """Create a secure hash of a token."""
-    return hashlib.sha256(token.encode()).hexdigest()
+    """Create a secure hash of a token (str or bytes)."""
+    if isinstance(token, str):
+        token = token.encode()
+    return hashlib.sha256(token).hexdigest()
+
+def copy_entity_states(rows):
+    """
+    Stream entity state rows into Postgres with COPY FROM STDIN.
+    
+    Uses psycopg 3's cursor.copy() or psycopg2's copy_expert(). Returns False
+    if the driver supports neither so the caller can fall back to INSERT.
+    """
+    raw = session.connection().connection.driver_connection
+    cursor = raw.cursor()
+    try:
+        if hasattr(cursor, "copy"):
+            # psycopg 3
+            with cursor.copy(
+                "COPY entity_states (entity_id, state, attributes, timestamp) FROM STDIN"
+            ) as copy:
+                for row in rows:
+                    copy.write_row((
+                        row["entity_id"], row["state"], json.dumps(row["attributes"]), row["timestamp"]
+                    ))
+            return True
+        
+        if hasattr(cursor, "copy_expert"):
+            # psycopg2
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow((
+                    row["entity_id"], row["state"], json.dumps(row["attributes"]), row["timestamp"].isoformat()
+                ))
+            buffer.seek(0)
+            cursor.copy_expert(
+                "COPY entity_states (entity_id, state, attributes, timestamp) FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+            return True
+        
+        return False
+    finally:
+        cursor.close()
+
+# Constant seed values, computed once at import time
+DEMO_TOKEN_HASH = hash_token(b"DEMO_TOKEN_NOT_REAL")
+SEED_NOW = datetime.utcnow()
 
 def add_demo_settings():
     """Add demo settings to the database."""
@@ -42,21 +113,9 @@ def add_demo_settings():
         {"key": "welcome_message", "value": "Welcome to Nexus AI, your intelligent home assistant!"}
     ]
     
-    for setting_data in settings:
-        # Check if setting exists
-        existing = session.query(Setting).filter_by(key=setting_data["key"]).first()
-        if existing:
-            # Update existing
-            existing.value = setting_data["value"]
-        else:
-            # Create new
-            setting = Setting(
-                key=setting_data["key"],
-                value=setting_data["value"]
-            )
-            session.add(setting)
+    # Upsert all settings in a single statement
+    session.execute(SETTING_UPSERT, settings)
     
-    session.commit()
     print("Demo settings added successfully.")
     
 def add_demo_ha_config():
@@ -66,15 +125,14 @@ def add_demo_ha_config():
     # Demo Home Assistant config
     ha_config = HomeAssistantConfig(
         url="http://homeassistant.local:8123",
-        token_hash=hash_token("DEMO_TOKEN_NOT_REAL"),
+        token_hash=DEMO_TOKEN_HASH,
         is_active=True,
-        last_connected_at=datetime.utcnow(),
+        last_connected_at=SEED_NOW,
         version="2023.12.3",
         location_name="Demo Home"
     )
     
     session.add(ha_config)
-    session.commit()
     print("Demo Home Assistant configuration added successfully.")
     
 def add_demo_entities():
@@ -141,66 +199,80 @@ def add_demo_entities():
         }
     ]
     
-    # Current time for reference
-    now = datetime.utcnow()
+    # Historical states are collected here and inserted in one batch
+    pending_states = []
+    
+    # Create entities that don't exist yet; RETURNING only yields the
+    # rows actually inserted, so existing entities get no new history
+    result = session.execute(
+        ENTITY_INSERT,
+        [
+            {
+                "entity_id": entity_data["entity_id"],
+                "friendly_name": entity_data["friendly_name"],
+                "domain": entity_data["domain"],
+                "is_important": entity_data["is_important"],
+                "attributes": entity_data["attributes"],
+                "last_state": entity_data["state"],
+                "last_updated": SEED_NOW
+            }
+            for entity_data in entities
+        ]
+    )
+    entity_ids = {row.entity_id: row.id for row in result}
+    
+    if not entity_ids:
+        print("Demo entities already present.")
+        return
     
-    for entity_data in entities:
-        # Check if entity exists
-        existing = session.query(Entity).filter_by(entity_id=entity_data["entity_id"]).first()
+    new_entities = [
+        entity_data for entity_data in entities
+        if entity_data["entity_id"] in entity_ids
+    ]
+    
+    for entity_data in new_entities:
+        entity_db_id = entity_ids[entity_data["entity_id"]]
         
-        if not existing:
-            # Create entity
-            entity = Entity(
-                entity_id=entity_data["entity_id"],
-                friendly_name=entity_data["friendly_name"],
-                domain=entity_data["domain"],
-                is_important=entity_data["is_important"],
-                attributes=entity_data["attributes"],
-                last_state=entity_data["state"],
-                last_updated=now
-            )
-            session.add(entity)
-            session.flush()  # Get the ID
+        # Add some historical states (for the past 24 hours, every 2 hours)
+        for i in range(12):
+            time_offset = SEED_NOW - timedelta(hours=i*2)
             
-            # Add some historical states (for the past 24 hours, every 2 hours)
-            for i in range(12):
-                time_offset = now - timedelta(hours=i*2)
-                
-                # Slight variations in state for sensors
-                state = entity_data["state"]
-                attributes = entity_data["attributes"].copy()
-                
-                if entity_data["domain"] == "sensor" and "unit_of_measurement" in attributes:
-                    if attributes["unit_of_measurement"] == "°C":
-                        # Temperature variations
-                        state_val = float(entity_data["state"]) + (i % 3 - 1)
-                        state = str(state_val)
-                    elif attributes["unit_of_measurement"] == "%":
-                        # Humidity variations
-                        state_val = float(entity_data["state"]) + (i % 5 - 2)
-                        state = str(state_val)
-                    elif attributes["unit_of_measurement"] == "kWh":
-                        # Energy variations
-                        state_val = float(entity_data["state"]) + (i * 0.2)
-                        state = str(state_val)
-                
-                # Binary sensor and switch/light states
-                elif entity_data["domain"] in ["binary_sensor", "switch", "light"]:
-                    # Alternate states
-                    state = "on" if i % 2 == 0 else "off"
-                    
-                    if entity_data["domain"] == "light" and state == "on":
-                        attributes["brightness"] = max(100, attributes.get("brightness", 255) - i * 10)
+            # Slight variations in state for sensors
+            # Attributes are shared by reference; only changed values get a new dict
+            state = entity_data["state"]
+            attributes = entity_data["attributes"]
+            
+            if entity_data["domain"] == "sensor" and "unit_of_measurement" in attributes:
+                if attributes["unit_of_measurement"] == "°C":
+                    # Temperature variations
+                    state_val = float(entity_data["state"]) + (i % 3 - 1)
+                    state = str(state_val)
+                elif attributes["unit_of_measurement"] == "%":
+                    # Humidity variations
+                    state_val = float(entity_data["state"]) + (i % 5 - 2)
+                    state = str(state_val)
+                elif attributes["unit_of_measurement"] == "kWh":
+                    # Energy variations
+                    state_val = float(entity_data["state"]) + (i * 0.2)
+                    state = str(state_val)
+            
+            # Binary sensor and switch/light states
+            elif entity_data["domain"] in ["binary_sensor", "switch", "light"]:
+                # Alternate states
+                state = "on" if i % 2 == 0 else "off"
                 
-                state_record = EntityState(
-                    entity_id=entity.id,
-                    state=state,
-                    attributes=attributes,
-                    timestamp=time_offset
-                )
-                session.add(state_record)
-        
-    session.commit()
+                if entity_data["domain"] == "light" and state == "on":
+                    attributes = {**attributes, "brightness": max(100, attributes.get("brightness", 255) - i * 10)}
+            
+            pending_states.append({
+                "entity_id": entity_db_id,
+                "state": state,
+                "attributes": attributes,
+                "timestamp": time_offset
+            })
+    
+    if not copy_entity_states(pending_states):
+        session.execute(ENTITY_STATE_INSERT, pending_states)
     print("Demo entities and states added successfully.")
     
 def add_demo_automations():
@@ -292,26 +364,23 @@ def add_demo_automations():
     # Combine all automations
     all_automations = automations + suggested_automations
     
-    for automation_data in all_automations:
-        # Check if automation exists by name
-        existing = session.query(Automation).filter_by(name=automation_data["name"]).first()
-        
-        if not existing:
-            # Create automation
-            automation = Automation(
-                name=automation_data["name"],
-                description=automation_data["description"],
-                triggers=automation_data["triggers"],
-                conditions=automation_data["conditions"],
-                actions=automation_data["actions"],
-                is_suggested=automation_data["is_suggested"],
-                confidence=automation_data["confidence"],
-                is_enabled=True,
-                last_triggered=None if automation_data["is_suggested"] else datetime.utcnow() - timedelta(days=1)
-            )
-            session.add(automation)
+    # Look up existing names in one query, then insert the rest in a single statement
+    existing = set(session.scalars(
+        select(Automation.name).where(Automation.name.in_([a["name"] for a in all_automations]))
+    ))
+    last_triggered = SEED_NOW - timedelta(days=1)
+    rows = [
+        {
+            **automation_data,
+            "is_enabled": True,
+            "last_triggered": None if automation_data["is_suggested"] else last_triggered
+        }
+        for automation_data in all_automations
+        if automation_data["name"] not in existing
+    ]
+    if rows:
+        session.execute(AUTOMATION_INSERT, rows)
     
-    session.commit()
     print("Demo automations added successfully.")
     
 def add_demo_memories():
@@ -347,21 +416,11 @@ def add_demo_memories():
         }
     ]
     
-    for memory_data in memories:
-        # Check if memory exists
-        existing = session.query(Memory).filter_by(key=memory_data["key"]).first()
-        
-        if not existing:
-            # Create memory
-            memory = Memory(
-                key=memory_data["key"],
-                value=memory_data["value"],
-                is_preference=memory_data["is_preference"],
-                embedding_id=None  # We don't have actual embeddings for demo data
-            )
-            session.add(memory)
+    # Insert all memories in a single statement, skipping existing keys
+    # (we don't have actual embeddings for demo data)
+    rows = [{**memory_data, "embedding_id": None} for memory_data in memories]
+    session.execute(MEMORY_INSERT, rows)
     
-    session.commit()
     print("Demo memories added successfully.")
     
 def add_demo_patterns():
@@ -410,34 +469,34 @@ def add_demo_patterns():
         }
     ]
     
-    for pattern_data in patterns:
-        # Check if pattern exists
-        existing = session.query(Pattern).filter_by(name=pattern_data["name"]).first()
-        
-        if not existing:
-            # Create pattern
-            pattern = Pattern(
-                name=pattern_data["name"],
-                pattern_type=pattern_data["pattern_type"],
-                entities=pattern_data["entities"],
-                data=pattern_data["data"],
-                confidence=pattern_data["confidence"],
-                times_detected=pattern_data["times_detected"]
-            )
-            session.add(pattern)
+    # Look up existing names in one query, then insert the rest in a single statement
+    existing = set(session.scalars(
+        select(Pattern.name).where(Pattern.name.in_([p["name"] for p in patterns]))
+    ))
+    patterns = [p for p in patterns if p["name"] not in existing]
+    if patterns:
+        session.execute(PATTERN_INSERT, patterns)
     
-    session.commit()
     print("Demo patterns added successfully.")
 
 def main():
     """Add all demo data."""
     try:
-        add_demo_settings()
-        add_demo_ha_config()
-        add_demo_entities()
-        add_demo_automations()
-        add_demo_memories()
-        add_demo_patterns()
+        # Stage everything in one transaction so the seed commits once.
+        # The helpers run sequentially on purpose: each is a single statement
+        # already, and a session/transaction cannot execute statements
+        # concurrently, so an async gather() would not overlap anything.
+        with session.begin():
+            # Demo data is regenerable and the seed is idempotent (ON CONFLICT),
+            # so don't wait for the WAL fsync when this transaction commits
+            session.execute(text("SET LOCAL synchronous_commit = OFF"))
+            
+            add_demo_settings()
+            add_demo_ha_config()
+            add_demo_entities()
+            add_demo_automations()
+            add_demo_memories()
+            add_demo_patterns()
         
         print("\nAll demo data has been added successfully!")
     except Exception as e:
@@ -1,7 +1,6 @@
 import os
 import sys
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import select
 from sqlalchemy.orm import sessionmaker
 
 # Get the DATABASE_URL from environment variables
@@ -12,18 +11,15 @@ if not DATABASE_URL:
 
 print(f"Initializing database connection to PostgreSQL with URL: {DATABASE_URL}")
 
-# Create base class for declarative models
-Base = declarative_base()
-
-# Import models - these will be added to the Base.metadata
+# Import models - these are registered on Base.metadata
 sys.path.append(os.path.abspath('.'))
-from nexus-ai-addon.nexus.models import (
-    Setting, HomeAssistantConfig, Entity, EntityState, 
-    Automation, Memory, Pattern
+from nexus.models import (
+    Base, Setting, HomeAssistantConfig, Entity, EntityState, 
+    Automation, Memory, Pattern, create_db_engine
 )
 
 # Create engine and session
-engine = create_engine(DATABASE_URL)
+engine = create_db_engine(DATABASE_URL, one_shot=True)
 Session = sessionmaker(bind=engine)
 
 def init_db():
@@ -42,7 +38,9 @@ def test_db():
         session.commit()
         
         # Query the setting back
-        result = session.query(Setting).filter_by(key="db_test").first()
+        result = session.execute(
+            select(Setting).where(Setting.key == "db_test")
+        ).scalar_one_or_none()
         print(f"Test setting retrieved: {result.key} = {result.value}")
         
         return True
@@ -1,19 +1,29 @@
 import os
 import logging
-import time
+import hashlib
+import threading
+from functools import wraps
+from itertools import chain
 from datetime import datetime
-from flask import Flask, render_template, redirect, url_for, jsonify, request
+import orjson
+from flask import Flask, Response, render_template, redirect, url_for, jsonify, request, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy import event, func, insert, select, text
+from sqlalchemy.orm import DeclarativeBase, raiseload
 
 from openai_helper import OpenAIHelper
+from nexus.semantic_cache import SemanticCache
+from nexus.hot_cache import HotCache
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI helper
+# Initialize OpenAI helper, semantic response cache and query hot cache
 openai_helper = OpenAIHelper()
+response_cache = SemanticCache()
+hot_cache = HotCache()
 
 # Define base model class
 class Base(DeclarativeBase):
@@ -22,15 +32,29 @@ class Base(DeclarativeBase):
 # Create SQLAlchemy extension instance
 db = SQLAlchemy(model_class=Base)
 
+class OrjsonProvider(JSONProvider):
+    """Serialize JSON responses with orjson, which handles datetimes natively."""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # Create Flask app
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = os.environ.get("SESSION_SECRET", "nexus-ai-secret-key")
 
 # Configure database connection
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "pool_size": 20,
+    "max_overflow": 10,
+    "pool_timeout": 5,
     "pool_recycle": 300,
-    "pool_pre_ping": True,
+    # Pre-ping costs a SELECT 1 per checkout; turn it off on a stable local network
+    "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true",
 }
 
 # Initialize SQLAlchemy with the Flask app
@@ -70,6 +94,9 @@ class HomeAssistantConfig(db.Model):
 class Entity(db.Model):
     """Store Home Assistant entity information."""
     __tablename__ = "entities"
+    __table_args__ = (
+        db.Index("ix_entities_domain_important", "domain", "is_important"),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     entity_id = db.Column(db.String(255), unique=True, nullable=False)
@@ -82,7 +109,10 @@ class Entity(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    state_history = db.relationship("EntityState", back_populates="entity", cascade="all, delete-orphan")
+    # Never lazy-load history: callers must opt in with selectinload() so a
+    # loop over entities can't silently issue one SELECT per row
+    state_history = db.relationship("EntityState", back_populates="entity", cascade="all, delete-orphan",
+                                    lazy="raise")
     
     def __repr__(self):
         return f"<Entity {self.entity_id}={self.last_state}>"
@@ -90,6 +120,15 @@ class Entity(db.Model):
 class EntityState(db.Model):
     """Store historical states of entities for pattern analysis."""
     __tablename__ = "entity_states"
+    __table_args__ = (
+        # Serves get_entity_history's newest-first scan for one entity (read
+        # backwards); name and columns match nexus/models.py, which shares the schema
+        db.Index("ix_entity_states_entity_id_timestamp", "entity_id", "timestamp"),
+        # History is append-only in timestamp order, so a tiny BRIN index
+        # covers time-range scans for pattern analysis
+        db.Index("ix_entity_states_ts_brin", "timestamp", postgresql_using="brin",
+                 postgresql_with={"pages_per_range": 32}),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     entity_id = db.Column(db.Integer, db.ForeignKey("entities.id"), nullable=False)
@@ -141,6 +180,9 @@ class Memory(db.Model):
 class Pattern(db.Model):
     """Store detected usage patterns for smart suggestions."""
     __tablename__ = "patterns"
+    __table_args__ = (
+        db.Index("ix_patterns_type_confidence", "pattern_type", "confidence"),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
@@ -158,6 +200,24 @@ class Pattern(db.Model):
 # Set static folder
 app.static_folder = 'static'
 
+def cacheable(view):
+    """Let clients revalidate a GET endpoint with ETag / If-None-Match."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        response = app.make_response(view(*args, **kwargs))
+        response.headers["Cache-Control"] = "private, max-age=30"
+        
+        if response.status_code == 200:
+            # Streamed bodies can't be hashed without buffering them; streaming
+            # views set their own ETag from a cheap version key instead
+            if not response.is_streamed:
+                response.set_etag(hashlib.blake2b(response.get_data(), digest_size=16).hexdigest())
+            if response.get_etag()[0]:
+                response.make_conditional(request)
+        
+        return response
+    return wrapper
+
 # Routes
 @app.route('/')
 def index():
@@ -195,12 +255,13 @@ def health_check():
     return jsonify({"status": "online"})
 
 @app.route('/api/settings')
+@cacheable
 def get_settings():
     """Get all settings."""
-    settings = Setting.query.all()
-    result = {}
-    for s in settings:
-        result[s.key] = s.value
+    result = hot_cache.get_or_set(
+        "settings:all",
+        lambda: dict(db.session.execute(select(Setting.key, Setting.value)).all())
+    )
     return jsonify({"settings": result})
 
 @app.route('/api/settings/<key>', methods=['GET'])
@@ -229,43 +290,58 @@ def save_setting():
         db.session.add(setting)
     
     db.session.commit()
+    hot_cache.delete("settings:all")
     return jsonify({"success": True, "key": key, "value": value})
 
 @app.route('/api/entities')
+@cacheable
 def get_entities():
     """Get all entities with optional filtering."""
     domain = request.args.get('domain')
     important_only = request.args.get('important_only', 'false').lower() == 'true'
     
-    query = Entity.query
-    
+    filters = []
     if domain:
-        query = query.filter_by(domain=domain)
+        filters.append(Entity.domain == domain)
     
     if important_only:
-        query = query.filter_by(is_important=True)
-    
-    entities = query.all()
-    result = []
-    
-    for entity in entities:
-        result.append({
-            "id": entity.id,
-            "entity_id": entity.entity_id,
-            "friendly_name": entity.friendly_name,
-            "domain": entity.domain,
-            "is_important": entity.is_important,
-            "attributes": entity.attributes,
-            "last_state": entity.last_state,
-            "last_updated": entity.last_updated.isoformat() if entity.last_updated else None
-        })
-    
-    return jsonify({"entities": result})
+        filters.append(Entity.is_important.is_(True))
+    
+    stmt = select(
+        Entity.id, Entity.entity_id, Entity.friendly_name, Entity.domain,
+        Entity.is_important, Entity.attributes, Entity.last_state, Entity.last_updated
+    ).where(*filters)
+    
+    # The streamed body can't be hashed, so version the response by row
+    # count and latest change; an unchanged poll is answered with a 304
+    # without reading any entity rows
+    version = db.session.execute(
+        select(func.count(), func.max(Entity.updated_at), func.max(Entity.last_updated)).where(*filters)
+    ).one()
+    etag = hashlib.blake2b(
+        f"{domain}:{important_only}:{version[0]}:{version[1]}:{version[2]}".encode(), digest_size=16
+    ).hexdigest()
+    
+    # Fetch and serialize in batches so large installations never hold
+    # every entity in memory at once
+    stmt = stmt.execution_options(yield_per=500)
+    
+    def generate():
+        yield b'{"entities":['
+        separator = b""
+        for row in db.session.execute(stmt).mappings():
+            yield separator + orjson.dumps(dict(row))
+            separator = b","
+        yield b"]}"
+    
+    response = Response(stream_with_context(generate()), mimetype="application/json")
+    response.set_etag(etag)
+    return response
 
 @app.route('/api/entities/<entity_id>')
 def get_entity(entity_id):
     """Get a specific entity by ID."""
-    entity = Entity.query.filter_by(entity_id=entity_id).first()
+    entity = Entity.query.options(raiseload("*")).filter_by(entity_id=entity_id).first()
     if not entity:
         return jsonify({"error": "Entity not found"}), 404
     
@@ -277,7 +353,7 @@ def get_entity(entity_id):
         "is_important": entity.is_important,
         "attributes": entity.attributes,
         "last_state": entity.last_state,
-        "last_updated": entity.last_updated.isoformat() if entity.last_updated else None
+        "last_updated": entity.last_updated
     }
     
     return jsonify(result)
@@ -287,11 +363,11 @@ def get_entity_history(entity_id):
     """Get the history for a specific entity."""
     limit = request.args.get('limit', 100, type=int)
     
-    entity = Entity.query.filter_by(entity_id=entity_id).first()
+    entity = Entity.query.options(raiseload("*")).filter_by(entity_id=entity_id).first()
     if not entity:
         return jsonify({"error": "Entity not found"}), 404
     
-    states = EntityState.query.filter_by(entity_id=entity.id).order_by(
+    states = EntityState.query.options(raiseload("*")).filter_by(entity_id=entity.id).order_by(
         EntityState.timestamp.desc()).limit(limit).all()
     
     result = []
@@ -299,7 +375,7 @@ def get_entity_history(entity_id):
         result.append({
             "state": state.state,
             "attributes": state.attributes,
-            "timestamp": state.timestamp.isoformat()
+            "timestamp": state.timestamp
         })
     
     return jsonify({"entity_id": entity_id, "history": result})
@@ -309,29 +385,17 @@ def get_automations():
     """Get all automations with optional filtering."""
     suggested_only = request.args.get('suggested_only', 'false').lower() == 'true'
     
-    query = Automation.query
+    stmt = select(
+        Automation.id, Automation.name, Automation.entity_id, Automation.description,
+        Automation.triggers, Automation.conditions, Automation.actions,
+        Automation.is_enabled, Automation.is_suggested, Automation.confidence,
+        Automation.created_at, Automation.last_triggered
+    )
     
     if suggested_only:
-        query = query.filter_by(is_suggested=True)
+        stmt = stmt.where(Automation.is_suggested.is_(True))
     
-    automations = query.all()
-    result = []
-    
-    for automation in automations:
-        result.append({
-            "id": automation.id,
-            "name": automation.name,
-            "entity_id": automation.entity_id,
-            "description": automation.description,
-            "triggers": automation.triggers,
-            "conditions": automation.conditions,
-            "actions": automation.actions,
-            "is_enabled": automation.is_enabled,
-            "is_suggested": automation.is_suggested,
-            "confidence": automation.confidence,
-            "created_at": automation.created_at.isoformat(),
-            "last_triggered": automation.last_triggered.isoformat() if automation.last_triggered else None
-        })
+    result = [dict(row) for row in db.session.execute(stmt).mappings()]
     
     return jsonify({"automations": result})
 
@@ -340,55 +404,134 @@ def get_memories():
     """Get all memories with optional filtering."""
     preferences_only = request.args.get('preferences_only', 'false').lower() == 'true'
     
-    query = Memory.query
+    stmt = select(
+        Memory.id, Memory.key, Memory.value, Memory.is_preference,
+        Memory.created_at, Memory.updated_at
+    )
     
     if preferences_only:
-        query = query.filter_by(is_preference=True)
+        stmt = stmt.where(Memory.is_preference.is_(True))
     
-    memories = query.all()
-    result = []
-    
-    for memory in memories:
-        result.append({
-            "id": memory.id,
-            "key": memory.key,
-            "value": memory.value,
-            "is_preference": memory.is_preference,
-            "created_at": memory.created_at.isoformat(),
-            "updated_at": memory.updated_at.isoformat()
-        })
+    result = [dict(row) for row in db.session.execute(stmt).mappings()]
     
     return jsonify({"memories": result})
 
 @app.route('/api/patterns')
+@cacheable
 def get_patterns():
     """Get all detected patterns with optional filtering."""
     pattern_type = request.args.get('pattern_type')
     min_confidence = request.args.get('min_confidence', 0.0, type=float)
     
-    query = Pattern.query.filter(Pattern.confidence >= min_confidence)
+    stmt = select(
+        Pattern.id, Pattern.name, Pattern.pattern_type, Pattern.entities, Pattern.data,
+        Pattern.confidence, Pattern.times_detected, Pattern.created_at, Pattern.updated_at
+    ).where(Pattern.confidence >= min_confidence)
     
     if pattern_type:
-        query = query.filter_by(pattern_type=pattern_type)
+        stmt = stmt.where(Pattern.pattern_type == pattern_type)
     
-    patterns = query.all()
-    result = []
-    
-    for pattern in patterns:
-        result.append({
-            "id": pattern.id,
-            "name": pattern.name,
-            "pattern_type": pattern.pattern_type,
-            "entities": pattern.entities,
-            "data": pattern.data,
-            "confidence": pattern.confidence,
-            "times_detected": pattern.times_detected,
-            "created_at": pattern.created_at.isoformat(),
-            "updated_at": pattern.updated_at.isoformat()
-        })
+    result = [dict(row) for row in db.session.execute(stmt).mappings()]
     
     return jsonify({"patterns": result})
 
+# Important entities, preference memories and confident patterns for /api/ask,
+# precomputed in one view; (kind, id) is unique so it can refresh CONCURRENTLY
+ASK_CONTEXT_VIEW_DDL = (
+    """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS ask_context_mv AS
+    SELECT 'entity' AS kind, id, entity_id AS a, friendly_name AS b, domain AS c, last_state AS d,
+           NULL::double precision AS confidence
+    FROM entities WHERE is_important
+    UNION ALL
+    SELECT 'memory', id, key, value, NULL, NULL, NULL
+    FROM memories WHERE is_preference
+    UNION ALL
+    SELECT 'pattern', id, name, pattern_type, NULL, NULL, confidence
+    FROM patterns WHERE confidence >= 0.7
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_ask_context_mv_kind_id ON ask_context_mv (kind, id)",
+)
+REFRESH_ASK_CONTEXT_VIEW = text("REFRESH MATERIALIZED VIEW CONCURRENTLY ask_context_mv")
+
+@event.listens_for(db.session.session_factory, "after_flush")
+def mark_ask_context_changed(session, flush_context):
+    """Note when a flush changed rows the ask context view is built from."""
+    # new/dirty/deleted still describe the flushed objects at this point
+    changed = any(
+        isinstance(obj, (Entity, Pattern)) or (isinstance(obj, Memory) and obj.is_preference)
+        for obj in session.new
+    ) or any(
+        isinstance(obj, (Entity, Memory, Pattern))
+        for obj in chain(session.dirty, session.deleted)
+    )
+    
+    if changed:
+        session.info["ask_context_changed"] = True
+
+# Set by commits that touched the view's rows; a background thread in each
+# worker coalesces them into one refresh at a time, off the request path
+ask_context_stale = threading.Event()
+ask_context_refresher = None
+ask_context_refresher_lock = threading.Lock()
+
+def refresh_ask_context_loop():
+    """Rebuild the ask context view whenever a commit marks it stale."""
+    while True:
+        ask_context_stale.wait()
+        ask_context_stale.clear()
+        try:
+            with app.app_context(), db.engine.begin() as connection:
+                connection.execute(REFRESH_ASK_CONTEXT_VIEW)
+        except Exception:
+            app.logger.exception("Failed to refresh the ask context view")
+        
+        # Dropping the cache only once the view is current keeps /api/ask
+        # from re-caching the old rows
+        hot_cache.delete("ask:context")
+
+@event.listens_for(db.session.session_factory, "after_commit")
+def refresh_ask_context(session):
+    """Schedule an ask context view refresh once a commit has made the changes visible."""
+    global ask_context_refresher
+    
+    if session.info.pop("ask_context_changed", False):
+        # Started lazily so each forked gunicorn worker gets its own thread
+        with ask_context_refresher_lock:
+            if ask_context_refresher is None or not ask_context_refresher.is_alive():
+                ask_context_refresher = threading.Thread(target=refresh_ask_context_loop, daemon=True)
+                ask_context_refresher.start()
+        ask_context_stale.set()
+
+@event.listens_for(db.session.session_factory, "after_rollback")
+def discard_ask_context_change(session):
+    """Forget changes that were rolled back."""
+    session.info.pop("ask_context_changed", None)
+
+def load_ask_context():
+    """Load important entities, preference memories and confident patterns from the view."""
+    stmt = text("SELECT kind, a, b, c, d, confidence FROM ask_context_mv")
+    
+    context = {}
+    for row in db.session.execute(stmt):
+        if row.kind == "entity":
+            context.setdefault("entities", []).append({
+                "entity_id": row.a,
+                "friendly_name": row.b,
+                "domain": row.c,
+                "last_state": row.d
+            })
+        elif row.kind == "memory":
+            context.setdefault("memories", []).append({"key": row.a, "value": row.b})
+        else:
+            context.setdefault("patterns", []).append({
+                "name": row.a,
+                "pattern_type": row.b,
+                "confidence": row.confidence
+            })
+    
+    return context
+
 @app.route('/api/ask', methods=['POST'])
 def ask():
     """Process a natural language request through the OpenAI agent."""
@@ -399,55 +542,25 @@ def ask():
         
         prompt = data['prompt']
         context = data.get('context', {})
+        cache_namespace = data.get('session_id')
+        
+        # Answer near-duplicate prompts from the semantic cache, unless the
+        # caller supplied its own context; without a session_id every client
+        # would share one namespace, so those requests are never cached
+        use_cache = not context and cache_namespace is not None
+        if use_cache:
+            cached_response = response_cache.lookup(prompt, cache_namespace)
+            if cached_response is not None:
+                return jsonify({"response": cached_response, "cached": True})
         
         # Prepare context with relevant data from the database
         if not context:
-            context = {}
-            
-            # Add important entities
-            important_entities = Entity.query.filter_by(is_important=True).all()
-            if important_entities:
-                context['entities'] = [
-                    {
-                        "entity_id": entity.entity_id,
-                        "friendly_name": entity.friendly_name,
-                        "domain": entity.domain,
-                        "last_state": entity.last_state
-                    }
-                    for entity in important_entities
-                ]
-            
-            # Add relevant memories
-            preference_memories = Memory.query.filter_by(is_preference=True).all()
-            if preference_memories:
-                context['memories'] = [
-                    {
-                        "key": memory.key,
-                        "value": memory.value
-                    }
-                    for memory in preference_memories
-                ]
-            
-            # Add patterns with high confidence
-            high_confidence_patterns = Pattern.query.filter(Pattern.confidence >= 0.7).all()
-            if high_confidence_patterns:
-                context['patterns'] = [
-                    {
-                        "name": pattern.name,
-                        "pattern_type": pattern.pattern_type,
-                        "confidence": pattern.confidence
-                    }
-                    for pattern in high_confidence_patterns
-                ]
+            context = hot_cache.get_or_set("ask:context", load_ask_context)
         
         # Process the query
         response = openai_helper.process_query(prompt, context)
-        
-        # Save the query as a memory
-        memory_key = f"query_{int(time.time())}"
-        memory = Memory(key=memory_key, value=prompt, is_preference=False)
-        db.session.add(memory)
-        db.session.commit()
+        if use_cache and openai_helper.api_key and not response.startswith("Error processing your request"):
+            response_cache.store(prompt, response, cache_namespace)
         
         return jsonify({"response": response})
     
@@ -459,6 +572,18 @@ def ask():
 with app.app_context():
     db.create_all()
     
+    # Drop the earlier names of indexes now shared with nexus/models.py
+    for index_name in ("ix_entity_states_entity_ts", "ix_patterns_type_conf"):
+        db.session.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+    
+    # Create the ask context view, and refresh it to pick up rows written
+    # outside this app (e.g. add_demo_data.py) since the last start
+    for ddl in ASK_CONTEXT_VIEW_DDL:
+        db.session.execute(text(ddl))
+    db.session.execute(REFRESH_ASK_CONTEXT_VIEW)
+    db.session.commit()
+    hot_cache.delete("ask:context")
+    
     # Add default settings if they don't exist
     default_settings = {
         "version": "0.1.0",
@@ -470,11 +595,20 @@ with app.app_context():
         "suggestion_threshold": "0.7"
     }
     
-    for key, value in default_settings.items():
-        if not Setting.query.filter_by(key=key).first():
-            db.session.add(Setting(key=key, value=value))
+    existing = set(db.session.scalars(
+        select(Setting.key).where(Setting.key.in_(default_settings))
+    ).all())
+    missing = [
+        {"key": key, "value": value}
+        for key, value in default_settings.items()
+        if key not in existing
+    ]
+    
+    if missing:
+        db.session.execute(insert(Setting), missing)
     
     db.session.commit()
+    hot_cache.delete("settings:all")
 
 # This is used by Gunicorn to find the Flask app
 if __name__ == '__main__':
@@ -3,17 +3,26 @@ Google Calendar integration for Nexus AI
 """
 import os
 import logging
-import json
 import pickle
-from typing import Dict, List, Optional, Any
-from datetime import datetime, timedelta
+import time
+import uuid
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, List, Optional, Any, Awaitable, Callable, Tuple
+from datetime import date, datetime, timedelta
 import asyncio
 from pathlib import Path
 
-import google.oauth2.credentials
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+import httpx
+import orjson
+# Google auth libraries are optional; without them the calendar stays disabled
+try:
+    import google.oauth2.credentials
+    from google.auth.transport.requests import Request
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    _HAS_GOOGLE = True
+except ImportError:
+    _HAS_GOOGLE = False
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -21,6 +30,26 @@ logger = logging.getLogger(__name__)
 
 # Google Calendar API configuration
 SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
+EVENTS_URL = 'https://www.googleapis.com/calendar/v3/calendars/primary/events'
+WATCH_URL = f'{EVENTS_URL}/watch'
+STOP_CHANNEL_URL = 'https://www.googleapis.com/calendar/v3/channels/stop'
+# Partial response: only the event fields _format_event reads
+EVENT_FIELDS = 'items(id,summary,description,location,start,end,attendees/email,htmlLink,organizer/email,status)'
+
+# Refresh access tokens this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 300
+
+# Parsed credentials by token path, with the file mtime they were read at
+_CRED_CACHE: Dict[str, Tuple[float, Any]] = {}
+
+def _parse_iso(value: str) -> datetime:
+    """Parse an RFC 3339 timestamp; fromisoformat only accepts a 'Z' suffix from Python 3.11."""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+@lru_cache(maxsize=4096)
+def _format_iso(value: str) -> str:
+    """Reformat an RFC 3339 event timestamp; recurring events repeat the same strings."""
+    return _parse_iso(value).strftime('%Y-%m-%d %H:%M:%S')
 
 class GoogleCalendar:
     """Interface for Google Calendar API."""
@@ -28,83 +57,215 @@ class GoogleCalendar:
     def __init__(self, data_dir: str = None):
         """Initialize the Google Calendar client."""
         self.data_dir = data_dir or os.environ.get("DATA_DIR", "/data/nexus")
-        self.token_path = Path(self.data_dir) / "google_token.pickle"
+        self.token_path = Path(self.data_dir) / "google_token.json"
+        self.legacy_token_path = Path(self.data_dir) / "google_token.pickle"
         self.credentials_path = Path(self.data_dir) / "google_credentials.json"
         self.credentials = None
-        self.service = None
+        self._session = None
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task = None
+        # Push notification channel, if a public webhook URL is configured
+        self.webhook_url = os.environ.get("CALENDAR_WEBHOOK_URL")
+        self._watch_channel = None
+        self._watch_task = None
+        # Opt-in local mirror of the calendar kept current with sync tokens;
+        # the first sync pulls every event, later ones only changes
+        self.incremental_sync = os.environ.get("CALENDAR_INCREMENTAL_SYNC", "false").lower() == "true"
+        self._sync_token = None
+        self._synced_events: Dict[str, Dict[str, Any]] = {}
+        self._sync_lock = asyncio.Lock()
+        # Recent event lists by query key; bursts of queries share one API call
+        self.events_ttl = float(os.environ.get("CALENDAR_CACHE_TTL", "60"))
+        self._events_cache: Dict[Tuple, Tuple[float, List[Dict[str, Any]]]] = {}
+        self._events_locks = defaultdict(asyncio.Lock)
+        # "Today" means the local day; look the zone up once, not per query
+        self._local_tz = datetime.now().astimezone().tzinfo
         self._load_credentials()
     
     def _load_credentials(self):
-        """Load or refresh Google API credentials."""
+        """Load Google API credentials from the token file."""
+        if not _HAS_GOOGLE:
+            logger.warning("Google API libraries not installed, calendar integration disabled")
+            return
+        
+        self._migrate_legacy_token()
+        
         # Check if token file exists
         if self.token_path.exists():
             try:
-                with open(self.token_path, 'rb') as token:
-                    self.credentials = pickle.load(token)
+                # Reuse credentials already parsed from this exact file
+                mtime = self.token_path.stat().st_mtime
+                cached = _CRED_CACHE.get(str(self.token_path))
+                if cached and cached[0] == mtime:
+                    self.credentials = cached[1]
+                else:
+                    with open(self.token_path, 'rb') as token:
+                        info = orjson.loads(token.read())
+                    
+                    # A token granted for fewer scopes than we now need only
+                    # earns 403s; drop it so the user re-authorizes
+                    granted = info.get('scopes') or []
+                    if isinstance(granted, str):
+                        granted = granted.split()
+                    if not set(SCOPES).issubset(granted):
+                        logger.warning("Google token scopes changed, re-authorization required")
+                        self.token_path.unlink()
+                        return
+                    
+                    self.credentials = google.oauth2.credentials.Credentials.from_authorized_user_info(
+                        info, SCOPES
+                    )
+                    _CRED_CACHE[str(self.token_path)] = (mtime, self.credentials)
             except Exception as e:
                 logger.error(f"Error loading token file: {str(e)}")
                 self.credentials = None
         
-        # Check if credentials are valid
-        if self.credentials and self.credentials.expired and self.credentials.refresh_token:
+        # An expired token is refreshed off the event loop by the refresh task
+        # or the first request, rather than with a blocking call here
+        if self.credentials and (not self.credentials.expired or self.credentials.refresh_token):
+            logger.info("Google Calendar credentials loaded")
+        else:
+            logger.warning("Google Calendar credentials not available or expired")
+    
+    async def _get_session(self):
+        """Get or create the HTTP session."""
+        if self._session is None or self._session.is_closed:
+            # HTTP/2 lets concurrent calls (e.g. get_events_batch) share one
+            # connection; fall back to keep-alive HTTP/1.1 without the h2 package
             try:
-                self.credentials.refresh(Request())
-                self._save_token(self.credentials)
+                self._session = httpx.AsyncClient(http2=True)
+            except ImportError:
+                self._session = httpx.AsyncClient()
+        return self._session
+    
+    async def start(self):
+        """Start refreshing the access token in the background, ahead of its expiry."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+        if self.webhook_url and (self._watch_task is None or self._watch_task.done()):
+            self._watch_task = asyncio.create_task(self._watch_loop())
+    
+    async def _refresh_loop(self):
+        """Refresh the token TOKEN_REFRESH_MARGIN seconds before it expires, forever."""
+        while True:
+            delay = 60  # seconds; re-check for credentials authorized later
+            creds = self.credentials
+            if creds and creds.refresh_token and creds.expiry:
+                delay = (creds.expiry - datetime.utcnow()).total_seconds() - TOKEN_REFRESH_MARGIN
+                if delay <= 0:
+                    if await self._refresh_credentials(TOKEN_REFRESH_MARGIN):
+                        continue
+                    delay = 60
+            
+            await asyncio.sleep(delay)
+    
+    async def _refresh_credentials(self, margin: float = 0) -> bool:
+        """
+        Refresh the token unless it is still valid for more than margin seconds.
+        
+        Concurrent callers share one refresh: whoever gets the lock second
+        sees the new expiry and returns without another round-trip.
+        """
+        async with self._refresh_lock:
+            creds = self.credentials
+            if not creds:
+                return False
+            
+            if creds.valid and (not creds.expiry or creds.expiry - datetime.utcnow() > timedelta(seconds=margin)):
+                return True
+            
+            if not creds.refresh_token:
+                return False
+            
+            def refresh():
+                creds.refresh(Request())
+                self._save_token(creds)
+            
+            try:
+                # google-auth refreshes over blocking HTTP; keep it off the event loop
+                await asyncio.to_thread(refresh)
                 logger.info("Refreshed Google Calendar credentials")
+                return True
             except Exception as e:
                 logger.error(f"Error refreshing credentials: {str(e)}")
-                self.credentials = None
+                return False
+    
+    async def _ensure_credentials(self) -> bool:
+        """Check the cached credentials are usable, refreshing the token in place if it expired."""
+        if not self.credentials:
+            return False
         
-        # Initialize service if credentials are valid
-        if self.credentials and not self.credentials.expired:
-            try:
-                self.service = build('calendar', 'v3', credentials=self.credentials)
-                logger.info("Google Calendar service initialized")
-            except Exception as e:
-                logger.error(f"Error building calendar service: {str(e)}")
-                self.service = None
-        else:
-            logger.warning("Google Calendar credentials not available or expired")
+        # Normally the background task has already refreshed the token
+        if self.credentials.valid:
+            return True
+        
+        return await self._refresh_credentials()
     
     def _save_token(self, creds):
         """Save the current token for future use."""
         try:
+            _CRED_CACHE.pop(str(self.token_path), None)
+            
             # Ensure directory exists
             os.makedirs(os.path.dirname(self.token_path), exist_ok=True)
             
-            # Save credentials
-            with open(self.token_path, 'wb') as token:
-                pickle.dump(creds, token)
+            # Write a temp file and rename it over the token, so a crash
+            # mid-write can't leave a truncated file that forces re-auth
+            tmp_path = self.token_path.with_name(self.token_path.name + '.tmp')
+            with open(tmp_path, 'w') as token:
+                token.write(creds.to_json())
+                token.flush()
+                os.fsync(token.fileno())
+            os.replace(tmp_path, self.token_path)
                 
             logger.info(f"Token saved to {self.token_path}")
         except Exception as e:
             logger.error(f"Error saving token: {str(e)}")
     
+    def _migrate_legacy_token(self):
+        """Convert a token pickled by older versions to the JSON token file, once."""
+        if self.token_path.exists() or not self.legacy_token_path.exists():
+            return
+        
+        try:
+            with open(self.legacy_token_path, 'rb') as token:
+                creds = pickle.load(token)
+            self._save_token(creds)
+            # Only drop the pickle once the JSON copy is on disk
+            if self.token_path.exists():
+                self.legacy_token_path.unlink()
+                logger.info("Migrated Google Calendar token from pickle to JSON")
+        except Exception as e:
+            logger.error(f"Error migrating legacy token file: {str(e)}")
+    
     async def authorize_with_code(self, auth_code: str) -> bool:
         """Authorize with Google using the provided code."""
+        if not _HAS_GOOGLE:
+            logger.error("Google API libraries not installed")
+            return False
+        
         try:
             # Check if credentials file exists
             if not self.credentials_path.exists():
                 logger.error("Google credentials file not found")
                 return False
             
-            # Run the authorization flow in a separate thread
+            # Run the authorization flow and token save in a separate thread;
+            # both block on network or disk
             def auth_flow():
                 flow = InstalledAppFlow.from_client_secrets_file(
                     self.credentials_path, SCOPES
                 )
                 flow.fetch_token(code=auth_code)
+                
+                # Save the credentials for future use
+                self._save_token(flow.credentials)
                 return flow.credentials
             
-            # Run in executor to avoid blocking
-            loop = asyncio.get_event_loop()
-            self.credentials = await loop.run_in_executor(None, auth_flow)
-            
-            # Save the credentials for future use
-            self._save_token(self.credentials)
-            
-            # Initialize service
-            self.service = build('calendar', 'v3', credentials=self.credentials)
+            self.credentials = await asyncio.to_thread(auth_flow)
+            self.invalidate()
+            self._sync_token = None
+            self._synced_events = {}
             
             return True
         except Exception as e:
@@ -113,32 +274,23 @@ class GoogleCalendar:
     
     async def get_today_events(self) -> List[Dict[str, str]]:
         """Get events for today from Google Calendar."""
-        # Run in executor to avoid blocking
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._get_today_events_sync)
-    
-    def _get_today_events_sync(self) -> List[Dict[str, str]]:
-        """Synchronous version of get_today_events."""
-        if not self.service:
-            logger.warning("Calendar service not initialized")
+        key = ("today", datetime.now(self._local_tz).date())
+        return await self._get_events_cached(key, self._fetch_today_events)
+    
+    async def _fetch_today_events(self) -> List[Dict[str, str]]:
+        """Fetch today's events from the Calendar API."""
+        if not await self._ensure_credentials():
+            logger.warning("Calendar credentials not initialized")
             return []
         
         try:
-            # Get today's date
-            now = datetime.utcnow()
-            start_of_day = datetime(now.year, now.month, now.day, 0, 0, 0).isoformat() + 'Z'
-            end_of_day = datetime(now.year, now.month, now.day, 23, 59, 59).isoformat() + 'Z'
+            # Local midnight to the next midnight; timeMax is exclusive
+            start_of_day = datetime.combine(datetime.now(self._local_tz).date(), datetime.min.time(),
+                                            tzinfo=self._local_tz)
+            end_of_day = start_of_day + timedelta(days=1)
             
             # Call the Calendar API
-            events_result = self.service.events().list(
-                calendarId='primary',
-                timeMin=start_of_day,
-                timeMax=end_of_day,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-            
-            events = events_result.get('items', [])
+            events = await self._list_events(start_of_day.isoformat(), end_of_day.isoformat())
             
             if not events:
                 logger.info('No events found for today.')
@@ -157,14 +309,121 @@ class GoogleCalendar:
     
     async def get_upcoming_events(self, days: int = 7) -> List[Dict[str, Any]]:
         """Get upcoming events for the next X days."""
-        # Run in executor to avoid blocking
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, lambda: self._get_upcoming_events_sync(days))
-    
-    def _get_upcoming_events_sync(self, days: int) -> List[Dict[str, Any]]:
-        """Synchronous version of get_upcoming_events."""
-        if not self.service:
-            logger.warning("Calendar service not initialized")
+        key = ("upcoming", days, datetime.utcnow().date())
+        return await self._get_events_cached(key, self._fetch_upcoming_events, days)
+    
+    async def _watch_loop(self):
+        """Keep a push channel open, renewing it an hour before Google expires it."""
+        while True:
+            expiration = await self.start_watch(self.webhook_url)
+            delay = 3600  # seconds; retry if the channel could not be opened
+            if expiration:
+                delay = max(expiration - time.time() - 3600, 60)
+            await asyncio.sleep(delay)
+    
+    async def start_watch(self, webhook_url: str) -> Optional[float]:
+        """
+        Ask Google to push event changes to webhook_url, replacing any open channel.
+        
+        Notifications arrive at the webhook and are passed to on_notification,
+        which drops the cached event lists.
+        
+        Args:
+            webhook_url: Public HTTPS URL that forwards to /api/calendar/notify
+        
+        Returns:
+            float: Channel expiry as a Unix timestamp, or None on failure
+        """
+        if not await self._ensure_credentials():
+            logger.warning("Calendar credentials not initialized")
+            return None
+        
+        try:
+            session = await self._get_session()
+            body = {'id': uuid.uuid4().hex, 'type': 'web_hook', 'address': webhook_url}
+            
+            resp = await session.post(WATCH_URL, json=body, headers=self._auth_headers())
+            if resp.status_code != 200:
+                raise Exception(f"Error watching events: {resp.status_code} - {resp.text}")
+            data = orjson.loads(resp.content)
+            
+            await self._stop_watch()
+            self._watch_channel = (data['id'], data['resourceId'])
+            logger.info(f"Watching Google Calendar for changes via {webhook_url}")
+            
+            expiration = data.get('expiration')
+            return int(expiration) / 1000 if expiration else None
+        except Exception as e:
+            logger.error(f"Error starting calendar watch: {str(e)}")
+            return None
+    
+    async def _stop_watch(self):
+        """Close the current push channel, if any."""
+        if not self._watch_channel:
+            return
+        
+        channel_id, resource_id = self._watch_channel
+        self._watch_channel = None
+        
+        try:
+            session = await self._get_session()
+            body = {'id': channel_id, 'resourceId': resource_id}
+            resp = await session.post(STOP_CHANNEL_URL, json=body, headers=self._auth_headers())
+            if resp.status_code not in (200, 204):
+                logger.warning(f"Error stopping calendar watch: {resp.status_code}")
+        except Exception as e:
+            logger.warning(f"Error stopping calendar watch: {str(e)}")
+    
+    def on_notification(self, channel_id: str, resource_state: str) -> bool:
+        """
+        Handle a push notification from Google.
+        
+        Args:
+            channel_id: The X-Goog-Channel-ID header
+            resource_state: The X-Goog-Resource-State header
+        
+        Returns:
+            bool: False if the notification is not for our open channel
+        """
+        if not self._watch_channel or channel_id != self._watch_channel[0]:
+            return False
+        
+        # "sync" only confirms the channel opened; anything else is a change
+        if resource_state != 'sync':
+            self.invalidate()
+        return True
+    
+    def invalidate(self):
+        """Forget cached event lists, e.g. when the calendar reports a change."""
+        self._events_cache.clear()
+    
+    async def _get_events_cached(self, key: Tuple, fetch: Callable[..., Awaitable[List[Dict[str, Any]]]],
+                                 *args) -> List[Dict[str, Any]]:
+        """Return events cached under key, fetching them if older than events_ttl."""
+        cached = self._events_cache.get(key)
+        if cached and time.monotonic() - cached[0] < self.events_ttl:
+            return cached[1]
+        
+        # One fetch per key at a time; waiters reuse its result
+        async with self._events_locks[key]:
+            cached = self._events_cache.get(key)
+            if cached and time.monotonic() - cached[0] < self.events_ttl:
+                return cached[1]
+            
+            events = await fetch(*args)
+            
+            # Drop expired entries (e.g. previous days) before adding this one
+            now = time.monotonic()
+            self._events_cache = {
+                k: v for k, v in self._events_cache.items() if now - v[0] < self.events_ttl
+            }
+            self._events_cache[key] = (now, events)
+            return events
+    
+    async def _fetch_upcoming_events(self, days: int) -> List[Dict[str, Any]]:
+        """Fetch the next X days of events from the Calendar API."""
+        if not await self._ensure_credentials():
+            logger.warning("Calendar credentials not initialized")
             return []
         
         try:
@@ -174,15 +433,7 @@ class GoogleCalendar:
             time_max = (now + timedelta(days=days)).isoformat() + 'Z'
             
             # Call the Calendar API
-            events_result = self.service.events().list(
-                calendarId='primary',
-                timeMin=time_min,
-                timeMax=time_max,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-            
-            events = events_result.get('items', [])
+            events = await self._list_events(time_min, time_max)
             
             if not events:
                 logger.info(f'No upcoming events found for next {days} days.')
@@ -199,6 +450,150 @@ class GoogleCalendar:
             logger.error(f"Error getting upcoming events: {str(e)}")
             return []
     
+    async def get_events_batch(self, requests: List[Dict[str, str]]) -> List[List[Dict[str, Any]]]:
+        """
+        Fetch several event ranges at once.
+        
+        The requests share one credentials check and go out concurrently over
+        the pooled keep-alive session, so N ranges cost about one round-trip.
+        
+        Args:
+            requests: Ranges to list, each a dict with 'timeMin' and 'timeMax'
+                RFC 3339 timestamps
+        
+        Returns:
+            list: Formatted events for each request, in request order; a
+                failed request yields an empty list
+        """
+        if not await self._ensure_credentials():
+            logger.warning("Calendar credentials not initialized")
+            return [[] for _ in requests]
+        
+        results = await asyncio.gather(
+            *(self._list_events(req['timeMin'], req['timeMax']) for req in requests),
+            return_exceptions=True
+        )
+        
+        batch = []
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Error getting batched events: {str(result)}")
+                batch.append([])
+            else:
+                batch.append([self._format_event(event) for event in result])
+        
+        return batch
+    
+    async def _list_events(self, time_min: str, time_max: str) -> List[Dict[str, Any]]:
+        """Call events.list on the primary calendar over the pooled session."""
+        if self.incremental_sync:
+            return await self._list_synced_events(time_min, time_max)
+        
+        session = await self._get_session()
+        params = {
+            'timeMin': time_min,
+            'timeMax': time_max,
+            'singleEvents': 'true',
+            'orderBy': 'startTime',
+            'maxResults': '250',
+            'fields': EVENT_FIELDS,
+        }
+        resp = await session.get(EVENTS_URL, params=params, headers=self._auth_headers())
+        if resp.status_code != 200:
+            raise Exception(f"Error listing events: {resp.status_code} - {resp.text}")
+        data = orjson.loads(resp.content)
+        
+        return data.get('items', [])
+    
+    async def _list_synced_events(self, time_min: str, time_max: str) -> List[Dict[str, Any]]:
+        """Answer an events.list window from the local mirror, after pulling changes."""
+        await self._sync_events()
+        
+        window_start = _parse_iso(time_min)
+        window_end = _parse_iso(time_max)
+        
+        # Same overlap rule as events.list: ends after timeMin, starts before timeMax
+        matches = []
+        for event in self._synced_events.values():
+            start = self._event_time(event.get('start', {}))
+            end = self._event_time(event.get('end', {}))
+            if start is not None and end is not None and start < window_end and end > window_start:
+                matches.append((start, event))
+        
+        matches.sort(key=lambda match: match[0])
+        return [event for _, event in matches]
+    
+    def _event_time(self, value: Dict[str, str]) -> Optional[datetime]:
+        """Parse an event start/end; all-day dates start at local midnight."""
+        if 'dateTime' in value:
+            return _parse_iso(value['dateTime'])
+        if 'date' in value:
+            return datetime.combine(date.fromisoformat(value['date']), datetime.min.time(), tzinfo=self._local_tz)
+        return None
+    
+    async def _sync_events(self):
+        """Bring the local event mirror up to date, with a full sync if there is no sync token."""
+        async with self._sync_lock:
+            session = await self._get_session()
+            params = {
+                'singleEvents': 'true',
+                'maxResults': '2500',
+                'fields': f'{EVENT_FIELDS},nextPageToken,nextSyncToken',
+            }
+            if self._sync_token:
+                params['syncToken'] = self._sync_token
+            
+            # Deltas are applied in place (re-applying them is harmless if a
+            # page fails); a full sync builds a fresh mirror
+            events = self._synced_events if self._sync_token else {}
+            
+            while True:
+                resp = await session.get(EVENTS_URL, params=params, headers=self._auth_headers())
+                if resp.status_code == 410 and 'syncToken' in params:
+                    # Google expired the sync token; start over with a full sync
+                    logger.info("Calendar sync token expired, running a full sync")
+                    self._sync_token = None
+                    params.pop('syncToken')
+                    params.pop('pageToken', None)
+                    events = {}
+                    continue
+                if resp.status_code != 200:
+                    raise Exception(f"Error syncing events: {resp.status_code} - {resp.text}")
+                data = orjson.loads(resp.content)
+                
+                for event in data.get('items', []):
+                    if event.get('status') == 'cancelled':
+                        events.pop(event['id'], None)
+                    else:
+                        events[event['id']] = event
+                
+                if 'nextPageToken' in data:
+                    params['pageToken'] = data['nextPageToken']
+                    continue
+                
+                self._synced_events = events
+                self._sync_token = data.get('nextSyncToken')
+                return
+    
+    def _auth_headers(self) -> Dict[str, str]:
+        """Get the HTTP headers for Calendar API requests."""
+        return {"Authorization": f"Bearer {self.credentials.token}"}
+    
+    async def close(self):
+        """Stop background tasks and the push channel, and close the HTTP session."""
+        for task in (self._refresh_task, self._watch_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        
+        await self._stop_watch()
+        
+        if self._session and not self._session.is_closed:
+            await self._session.aclose()
+    
     def _format_event(self, event: Dict[str, Any]) -> Dict[str, Any]:
         """Format a Google Calendar event into a simplified structure."""
         start = event.get('start', {})
@@ -209,8 +604,7 @@ class GoogleCalendar:
         all_day = False
         
         if 'dateTime' in start:
-            start_dt = datetime.fromisoformat(start['dateTime'].replace('Z', '+00:00'))
-            start_time = start_dt.strftime('%Y-%m-%d %H:%M:%S')
+            start_time = _format_iso(start['dateTime'])
         elif 'date' in start:
             start_time = start['date']
             all_day = True
@@ -218,11 +612,13 @@ class GoogleCalendar:
         # Extract end time
         end_time = None
         if 'dateTime' in end:
-            end_dt = datetime.fromisoformat(end['dateTime'].replace('Z', '+00:00'))
-            end_time = end_dt.strftime('%Y-%m-%d %H:%M:%S')
+            end_time = _format_iso(end['dateTime'])
         elif 'date' in end:
             end_time = end['date']
         
+        attendees = event.get('attendees')
+        organizer = event.get('organizer')
+        
         return {
             'id': event.get('id', ''),
             'summary': event.get('summary', 'No title'),
@@ -232,11 +628,9 @@ class GoogleCalendar:
             'end_time': end_time,
             'all_day': all_day,
             'attendees': [
-                attendee.get('email', '')
-                for attendee in event.get('attendees', [])
-                if attendee.get('email')
-            ],
+                attendee['email'] for attendee in attendees if attendee.get('email')
+            ] if attendees else [],
             'link': event.get('htmlLink', ''),
-            'organizer': event.get('organizer', {}).get('email', '') if event.get('organizer') else '',
+            'organizer': organizer.get('email', '') if organizer else '',
             'status': event.get('status', 'pending')
         }
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""
+Redis hot cache for Nexus AI
+"""
+import os
+import json
+import logging
+from typing import Any, Callable, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class HotCache:
+    """
+    Short-lived cache for rarely-changing query results, kept in Redis.
+    Falls back to calling the loader directly when Redis is not configured.
+    """
+
+    def __init__(self, url: Optional[str] = None, ttl: Optional[int] = None):
+        """Initialize the hot cache."""
+        self.url = url or os.environ.get("REDIS_URL")
+        self.ttl = ttl if ttl is not None else int(os.environ.get("HOT_CACHE_TTL", "300"))
+        self.client = None
+        self.initialize_client()
+
+    def initialize_client(self):
+        """Connect to Redis if a URL is configured."""
+        if not self.url:
+            logger.info("REDIS_URL not set, hot cache disabled")
+            return
+
+        try:
+            import redis
+
+            self.client = redis.Redis.from_url(self.url, socket_timeout=0.5)
+            self.client.ping()
+            logger.info("Hot cache connected to Redis")
+        except Exception as e:
+            logger.warning(f"Failed to connect to Redis: {str(e)}")
+            logger.warning("Queries will not be cached")
+            self.client = None
+
+    def get_or_set(self, key: str, loader: Callable[[], Any], ttl: Optional[int] = None) -> Any:
+        """
+        Return the cached value for a key, loading and caching it on a miss.
+
+        Args:
+            key: Cache key, e.g. "settings:all"
+            loader: Called on a miss; must return a JSON-serializable value
+            ttl: Seconds to keep the value, defaults to the cache TTL
+
+        Returns:
+            The cached or freshly loaded value
+        """
+        if not self.client:
+            return loader()
+
+        try:
+            cached = self.client.get(key)
+            if cached is not None:
+                return json.loads(cached)
+        except Exception as e:
+            logger.warning(f"Hot cache read failed for {key}: {str(e)}")
+            return loader()
+
+        value = loader()
+
+        try:
+            self.client.set(key, json.dumps(value), ex=ttl or self.ttl)
+        except Exception as e:
+            logger.warning(f"Hot cache write failed for {key}: {str(e)}")
+
+        return value
+
+    def delete(self, *keys: str) -> None:
+        """
+        Invalidate cached values after the underlying rows change.
+
+        Args:
+            keys: Cache keys to drop
+        """
+        if not self.client or not keys:
+            return
+
+        try:
+            self.client.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Hot cache invalidation failed for {keys}: {str(e)}")
@@ -2,11 +2,14 @@
 Main application module for Nexus AI
 """
 import os
+import asyncio
+import uuid
+import orjson
 import logging
 from typing import Dict, List, Optional, Any
 
 from fastapi import FastAPI, Request, WebSocket, HTTPException, Depends
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
@@ -16,6 +19,7 @@ from .database import DatabaseService
 from .ha_api import HomeAssistantAPI
 from .memory import MemoryManager
 from .calendar import GoogleCalendar
+from .semantic_cache import SemanticCache
 
 # Configure logging
 logging.basicConfig(
@@ -27,7 +31,8 @@ logger = logging.getLogger(__name__)
 # Initialize services
 db_service = DatabaseService()
 ha_api = HomeAssistantAPI()
-agent = NexusAgent(db_service, ha_api)
+response_cache = SemanticCache()
+agent = NexusAgent(db_service, ha_api, response_cache)
 memory_manager = MemoryManager(db_service)
 calendar = GoogleCalendar()
 
@@ -36,6 +41,7 @@ app = FastAPI(
     title="Nexus AI",
     description="AI assistant for Home Assistant",
     version="0.1.0",
+    default_response_class=ORJSONResponse,
 )
 
 # Configure CORS
@@ -95,6 +101,43 @@ async def ask(request: AskRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/ask/stream")
+async def ask_stream(request: AskRequest):
+    """Stream the AI agent's response as server-sent events."""
+    async def events():
+        async for text in agent.process_query_stream(request.prompt, request.context):
+            yield b"data: " + orjson.dumps({"token": text}) + b"\n\n"
+        yield b"data: [DONE]\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+# Pending and unread replies to /api/ask/batch queries, by job id
+batch_jobs: Dict[str, "asyncio.Future[str]"] = {}
+
+
+@app.post("/api/ask/batch")
+async def ask_batch(request: AskRequest):
+    """Queue a non-urgent query for OpenAI's Batch API; poll for the reply by job id."""
+    job_id = uuid.uuid4().hex
+    batch_jobs[job_id] = await agent.enqueue_query(request.prompt, request.context)
+    return {"job_id": job_id}
+
+
+@app.get("/api/ask/batch/{job_id}")
+async def get_batch_reply(job_id: str):
+    """Get the reply to a batched query; it is returned once, when its batch has completed."""
+    future = batch_jobs.get(job_id)
+    if future is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    
+    if not future.done():
+        return {"status": "pending"}
+    
+    del batch_jobs[job_id]
+    return {"status": "completed", "response": future.result()}
+
+
 @app.post("/api/action")
 async def action(request: ActionRequest):
     """Execute a Home Assistant service."""
@@ -165,12 +208,35 @@ async def get_memory(key: str):
 
 
 @app.get("/api/memories")
-async def get_all_memories(preferences_only: bool = False):
-    """Get all memories with optional filtering."""
-    memories = memory_manager.get_all(preferences_only)
+async def get_all_memories(preferences_only: bool = False, limit: Optional[int] = None,
+                           after_id: Optional[int] = None):
+    """Get all memories with optional filtering and keyset pagination."""
+    memories = memory_manager.get_all(preferences_only, limit, after_id)
+    # Returning the response directly skips FastAPI's jsonable_encoder pass,
+    # which would otherwise copy every row dict before orjson serializes it
+    return ORJSONResponse({"memories": memories})
+
+
+@app.get("/api/memories/search")
+async def search_memories(q: str, limit: int = 5):
+    """Full-text search over memories."""
+    # Each thread has its own SQLite connection, so the search can run off the loop
+    memories = await asyncio.to_thread(memory_manager.search, q, limit)
     return {"memories": memories}
 
 
+@app.post("/api/calendar/notify")
+async def calendar_notification(request: Request):
+    """Receive Google Calendar push notifications."""
+    known = calendar.on_notification(
+        request.headers.get("X-Goog-Channel-ID", ""),
+        request.headers.get("X-Goog-Resource-State", "")
+    )
+    if not known:
+        raise HTTPException(status_code=404, detail="Unknown channel")
+    return {"success": True}
+
+
 @app.post("/api/automation")
 async def create_automation(request: AutomationRequest):
     """Create a new automation."""
@@ -186,31 +252,50 @@ async def create_automation(request: AutomationRequest):
 
 
 @app.get("/api/automations")
-async def get_automations(suggested_only: bool = False):
-    """Get all automations with optional filtering."""
-    automations = db_service.get_automations(suggested_only)
-    return {"automations": automations}
+async def get_automations(suggested_only: bool = False, limit: Optional[int] = None,
+                          after_id: Optional[int] = None):
+    """Get all automations with optional filtering and keyset pagination."""
+    automations = db_service.get_automations(suggested_only, limit, after_id)
+    return ORJSONResponse({"automations": automations})
 
 
 @app.get("/api/entities")
-async def get_entities(domain: Optional[str] = None, important_only: bool = False):
-    """Get entities with optional filtering."""
-    entities = db_service.get_entities(domain, important_only)
-    return {"entities": entities}
+async def get_entities(domain: Optional[str] = None, important_only: bool = False,
+                       limit: Optional[int] = None, after_id: Optional[int] = None,
+                       include_attributes: bool = True):
+    """Get entities with optional filtering and keyset pagination."""
+    entities = db_service.get_entities(domain, important_only, limit, after_id, include_attributes)
+    return ORJSONResponse({"entities": entities})
 
 
 @app.get("/api/entity/{entity_id}/history")
 async def get_entity_history(entity_id: str, limit: int = 100):
     """Get historical states for an entity."""
     history = db_service.get_entity_history(entity_id, limit)
-    return {"history": history}
+    return ORJSONResponse({"history": history})
 
 
 @app.get("/api/patterns")
-async def get_patterns(pattern_type: Optional[str] = None, min_confidence: float = 0.0):
-    """Get detected patterns with optional filtering."""
-    patterns = db_service.get_patterns(pattern_type, min_confidence)
-    return {"patterns": patterns}
+async def get_patterns(pattern_type: Optional[str] = None, min_confidence: float = 0.0,
+                       limit: Optional[int] = None, after_id: Optional[int] = None):
+    """Get detected patterns with optional filtering and keyset pagination."""
+    patterns = db_service.get_patterns(pattern_type, min_confidence, limit, after_id)
+    return ORJSONResponse({"patterns": patterns})
+
+
+@app.on_event("startup")
+async def startup():
+    """Start background tasks."""
+    await calendar.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Close pooled client connections and write out queued state history."""
+    await agent.close()
+    await ha_api.close()
+    await calendar.close()
+    db_service.flush()
 
 
 # Mount static files
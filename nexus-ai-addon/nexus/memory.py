@@ -4,9 +4,9 @@ Memory management module for Nexus AI
 import os
 import logging
 import json
+import hashlib
 from typing import Dict, List, Optional, Any, Union
 from datetime import datetime
-import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -118,10 +118,12 @@ class MemoryManager:
                 
             embedding = embedding_response.data[0].embedding
             
-            # Store in ChromaDB
-            embedding_id = f"mem_{int(time.time())}"
+            # Store in ChromaDB under an ID derived from the (unique) memory key,
+            # so re-saving a memory replaces its embedding instead of colliding
+            # with other memories saved in the same second
+            embedding_id = f"mem_{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}"
             
-            self.collection.add(
+            self.collection.upsert(
                 ids=[embedding_id],
                 embeddings=[embedding],
                 metadatas=[{"key": key, "created_at": datetime.utcnow().isoformat()}],
@@ -145,6 +147,22 @@ class MemoryManager:
         """
         return self.db.get_memory(key)
     
+    def search(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        Search for memories sharing words with the query.
+        
+        Uses the database's full-text index, so unlike semantic_search it
+        needs no embedding call.
+        
+        Args:
+            query: Natural language query
+            limit: Maximum number of results
+            
+        Returns:
+            list: Matching memories sorted by relevance
+        """
+        return self.db.search_memories(query, limit)
+    
     def semantic_search(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
         """
         Search for memories semantically related to the query.
@@ -204,17 +222,20 @@ class MemoryManager:
             logger.error(f"Error performing semantic search: {str(e)}")
             return []
     
-    def get_all(self, preferences_only: bool = False) -> List[Dict[str, Any]]:
+    def get_all(self, preferences_only: bool = False, limit: Optional[int] = None,
+                after_id: Optional[int] = None) -> List[Dict[str, Any]]:
         """
         Get all memories with optional filtering.
         
         Args:
             preferences_only: Whether to return only preference memories
+            limit: Page size; pages are ordered by id
+            after_id: Last memory id of the previous page
             
         Returns:
             list: All matching memories
         """
-        return self.db.get_all_memories(preferences_only)
+        return self.db.get_all_memories(preferences_only, limit, after_id)
     
     def delete(self, key: str) -> bool:
         """
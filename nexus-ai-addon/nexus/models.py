@@ -2,13 +2,14 @@
 Database models for Nexus AI
 """
 import os
-from datetime import datetime
 from sqlalchemy import (
     create_engine, Column, Integer, String, Float, Boolean, 
-    Text, DateTime, ForeignKey, JSON
+    Text, DateTime, ForeignKey, Index, text, func
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.pool import NullPool
 
 Base = declarative_base()
 
@@ -19,8 +20,8 @@ class Setting(Base):
     id = Column(Integer, primary_key=True)
     key = Column(String(255), unique=True, nullable=False)
     value = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
     
     def __repr__(self):
         return f"<Setting {self.key}={self.value}>"
@@ -33,8 +34,8 @@ class HomeAssistantConfig(Base):
     url = Column(String(255), nullable=False)
     token_hash = Column(String(255), nullable=False)  # Store hash of token, never the token itself
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
     last_connected_at = Column(DateTime, nullable=True)
     version = Column(String(50), nullable=True)
     location_name = Column(String(255), nullable=True)
@@ -45,17 +46,22 @@ class HomeAssistantConfig(Base):
 class Entity(Base):
     """Store Home Assistant entity information."""
     __tablename__ = "entities"
+    __table_args__ = (
+        # Leading domain column also serves domain-only filters
+        Index("ix_entities_domain_important", "domain", "is_important"),
+        Index("ix_entities_attributes", "attributes", postgresql_using="gin"),
+    )
     
     id = Column(Integer, primary_key=True)
     entity_id = Column(String(255), unique=True, nullable=False)
     friendly_name = Column(String(255), nullable=True)
     domain = Column(String(50), nullable=False)  # light, switch, sensor, etc.
     is_important = Column(Boolean, default=False)
-    attributes = Column(JSON, nullable=True)
+    attributes = Column(JSONB, nullable=True)
     last_state = Column(String(255), nullable=True)
     last_updated = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
     
     state_history = relationship("EntityState", back_populates="entity", cascade="all, delete-orphan")
     
@@ -65,12 +71,19 @@ class Entity(Base):
 class EntityState(Base):
     """Store historical states of entities for pattern analysis."""
     __tablename__ = "entity_states"
+    __table_args__ = (
+        Index("ix_entity_states_entity_id_timestamp", "entity_id", "timestamp"),
+        # History is append-only in timestamp order, so a tiny BRIN index
+        # covers time-range scans for pattern analysis
+        Index("ix_entity_states_ts_brin", "timestamp", postgresql_using="brin",
+              postgresql_with={"pages_per_range": 32}),
+    )
     
     id = Column(Integer, primary_key=True)
     entity_id = Column(Integer, ForeignKey("entities.id"), nullable=False)
     state = Column(String(255), nullable=False)
-    attributes = Column(JSON, nullable=True)
-    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
+    attributes = Column(JSONB, nullable=True)
+    timestamp = Column(DateTime, server_default=func.now(), nullable=False)
     
     entity = relationship("Entity", back_populates="state_history")
     
@@ -80,19 +93,22 @@ class EntityState(Base):
 class Automation(Base):
     """Store automation configurations."""
     __tablename__ = "automations"
+    __table_args__ = (
+        Index("ix_automations_is_suggested", "is_suggested", postgresql_where=text("is_suggested")),
+    )
     
     id = Column(Integer, primary_key=True)
-    name = Column(String(255), nullable=False)
+    name = Column(String(255), unique=True, nullable=False)
     entity_id = Column(String(255), nullable=True)  # Link to Home Assistant entity ID if available
     description = Column(Text, nullable=True)
-    triggers = Column(JSON, nullable=False)
-    conditions = Column(JSON, nullable=True)
-    actions = Column(JSON, nullable=False)
+    triggers = Column(JSONB, nullable=False)
+    conditions = Column(JSONB, nullable=True)
+    actions = Column(JSONB, nullable=False)
     is_enabled = Column(Boolean, default=True)
     is_suggested = Column(Boolean, default=False)
     confidence = Column(Float, default=0.0)  # For AI-suggested automations
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
     last_triggered = Column(DateTime, nullable=True)
     
     def __repr__(self):
@@ -107,8 +123,8 @@ class Memory(Base):
     value = Column(Text, nullable=False)
     embedding_id = Column(String(255), nullable=True)  # ID in vector store
     is_preference = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
     
     def __repr__(self):
         return f"<Memory {self.key}>"
@@ -116,25 +132,52 @@ class Memory(Base):
 class Pattern(Base):
     """Store detected usage patterns for smart suggestions."""
     __tablename__ = "patterns"
+    __table_args__ = (
+        Index("ix_patterns_type_confidence", "pattern_type", "confidence"),
+    )
     
     id = Column(Integer, primary_key=True)
-    name = Column(String(255), nullable=False)
+    name = Column(String(255), unique=True, nullable=False)
     pattern_type = Column(String(50), nullable=False)  # time-based, correlation, presence, etc.
-    entities = Column(JSON, nullable=False)  # List of entity IDs involved in the pattern
-    data = Column(JSON, nullable=False)  # Pattern specific data
+    entities = Column(JSONB, nullable=False)  # List of entity IDs involved in the pattern
+    data = Column(JSONB, nullable=False)  # Pattern specific data
     confidence = Column(Float, default=0.0)
     times_detected = Column(Integer, default=1)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
     
     def __repr__(self):
         return f"<Pattern {self.name}>"
 
+# Engine factory shared by the service and the database scripts
+def create_db_engine(db_url=None, one_shot=False, **kwargs):
+    """
+    Create a database engine with explicit connection pool settings.
+    
+    PGBOUNCER_URL, when set, takes precedence over db_url/DATABASE_URL so
+    production deployments can route connections through PgBouncer.
+    One-shot scripts pass one_shot=True; with DB_NULLPOOL=true they open a
+    plain connection instead of holding a pool.
+    """
+    db_url = os.environ.get("PGBOUNCER_URL") or db_url or os.environ.get("DATABASE_URL")
+    
+    if one_shot and os.environ.get("DB_NULLPOOL", "false").lower() == "true":
+        return create_engine(db_url, poolclass=NullPool, future=True, **kwargs)
+    
+    return create_engine(
+        db_url,
+        pool_size=25,
+        max_overflow=25,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        future=True,
+        **kwargs
+    )
+
 # Database initialization function
 def init_db():
     """Initialize the database engine and create tables if they don't exist."""
-    db_url = os.environ.get("DATABASE_URL")
-    engine = create_engine(db_url)
+    engine = create_db_engine()
     Base.metadata.create_all(engine)
     Session = sessionmaker(bind=engine)
     return Session()
@@ -0,0 +1,128 @@
+"""
+Semantic response cache for Nexus AI
+"""
+import os
+import logging
+import time
+import hashlib
+from typing import Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class SemanticCache:
+    """
+    Cache of previously answered prompts, looked up by embedding similarity.
+    Lets near-duplicate questions skip the LLM round-trip entirely.
+    """
+
+    def __init__(self, threshold: Optional[float] = None, ttl: Optional[int] = None):
+        """Initialize the semantic cache."""
+        self.threshold = threshold if threshold is not None else float(
+            os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.9")
+        )
+        self.ttl = ttl if ttl is not None else int(os.environ.get("SEMANTIC_CACHE_TTL", "300"))
+        self.collection = None
+        self.initialize_store()
+
+    def initialize_store(self):
+        """Initialize the vector store used for similarity lookups."""
+        try:
+            import chromadb
+            from chromadb.config import Settings
+
+            # Get data directory from environment or use default
+            data_dir = os.environ.get("DATA_DIR", "/data/nexus")
+
+            # Create directory if it doesn't exist
+            os.makedirs(f"{data_dir}/response_cache", exist_ok=True)
+
+            # Initialize ChromaDB client
+            client = chromadb.Client(
+                Settings(
+                    persist_directory=f"{data_dir}/response_cache",
+                    anonymized_telemetry=False
+                )
+            )
+
+            # Prompts are embedded locally by Chroma's default embedding model
+            # (all-MiniLM-L6-v2); cosine space makes 1 - distance a similarity
+            self.collection = client.get_or_create_collection(
+                "responses",
+                metadata={"hnsw:space": "cosine"}
+            )
+
+            logger.info("Semantic cache initialized successfully")
+        except Exception as e:
+            logger.warning(f"Failed to initialize semantic cache: {str(e)}")
+            logger.warning("Responses will not be cached")
+
+    def lookup(self, prompt: str, namespace: str = "default") -> Optional[str]:
+        """
+        Find a cached response for a prompt similar to this one.
+
+        Args:
+            prompt: The incoming user prompt
+            namespace: User/session namespace the answer must belong to
+
+        Returns:
+            str: The cached response, or None on a miss
+        """
+        if not self.collection:
+            return None
+
+        try:
+            results = self.collection.query(
+                query_texts=[prompt],
+                n_results=1,
+                where={"$and": [
+                    {"namespace": namespace},
+                    {"created_at": {"$gte": time.time() - self.ttl}}
+                ]}
+            )
+
+            if not results["ids"] or not results["ids"][0]:
+                return None
+
+            similarity = 1.0 - results["distances"][0][0]
+            if similarity < self.threshold:
+                return None
+
+            logger.info(f"Semantic cache hit (similarity {similarity:.3f})")
+            return results["metadatas"][0][0]["response"]
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {str(e)}")
+            return None
+
+    def store(self, prompt: str, response: str, namespace: str = "default") -> None:
+        """
+        Store a response for a prompt.
+
+        Args:
+            prompt: The user prompt that was answered
+            response: The response to return for similar prompts
+            namespace: User/session namespace of the answer
+        """
+        if not self.collection:
+            return
+
+        try:
+            now = time.time()
+            
+            # Lookups already skip expired answers; drop them here so the
+            # collection doesn't grow by one embedding per distinct prompt
+            self.collection.delete(where={"created_at": {"$lt": now - self.ttl}})
+            
+            cache_id = hashlib.sha256(f"{namespace}:{prompt}".encode()).hexdigest()
+            self.collection.upsert(
+                ids=[cache_id],
+                documents=[prompt],
+                metadatas=[{
+                    "namespace": namespace,
+                    "response": response,
+                    "created_at": now
+                }]
+            )
+        except Exception as e:
+            logger.warning(f"Failed to store response in semantic cache: {str(e)}")
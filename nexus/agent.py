@@ -3,26 +3,111 @@ AI agent for Nexus
 """
 import os
 import re
+import asyncio
 import logging
-import json
-from typing import Dict, List, Optional, Any, Tuple, Union
+import orjson
+import time
+import uuid
+from collections import deque
+from typing import Dict, List, Optional, Any, Tuple, Union, AsyncIterator
 from datetime import datetime
 
+import httpx
+import numpy as np
 import openai
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# ACTION commands embedded in model replies, and their key="value"/key={...} params
+_ACTION_RE = re.compile(r'<ACTION:([A-Z_]+)\s+([^>]+)>')
+_ACTION_PARAM_RE = re.compile(r'(\w+)=(?:"([^"]*)"|\{([^}]*)\})')
+_JSON_KEY_RE = re.compile(r'(\w+):')
+
+# Query words that pull a domain's entities into the prompt
+_DOMAIN_KEYWORDS = {
+    "light": frozenset(["light", "lights", "lamp", "lamps", "on", "off", "brightness"]),
+    "switch": frozenset(["switch", "switches", "outlet", "outlets", "on", "off"]),
+    "sensor": frozenset(["temperature", "humidity", "sensor", "reading", "motion", "presence"]),
+    "climate": frozenset(["thermostat", "heat", "ac", "temperature", "cool"]),
+    "media_player": frozenset(["tv", "music", "play", "pause", "volume", "media", "movie"]),
+    "cover": frozenset(["blinds", "shades", "curtains", "garage", "door", "cover"]),
+    "person": frozenset(["person", "people", "who", "home", "away", "present"]),
+    "weather": frozenset(["weather", "forecast", "temperature", "rain", "wind", "snow"]),
+    "automation": frozenset(["automation", "automatic", "trigger", "scene"]),
+}
+_DEFAULT_DOMAINS = frozenset(["light", "switch", "sensor", "climate", "person"])
+
+# Inverted index from keyword to the domains it selects, and one alternation
+# regex that finds every keyword in a query in a single scan
+_KEYWORD_DOMAINS = {}
+for _domain, _keywords in _DOMAIN_KEYWORDS.items():
+    for _keyword in _keywords:
+        _KEYWORD_DOMAINS.setdefault(_keyword, set()).add(_domain)
+_KEYWORD_RE = re.compile(
+    r'\b(' + '|'.join(re.escape(kw) for kw in sorted(_KEYWORD_DOMAINS, key=len, reverse=True)) + r')\b',
+    re.IGNORECASE
+)
+
+# Entity attributes worth showing the model alongside the state
+_IMPORTANT_ATTRS = frozenset(["temperature", "humidity", "brightness", "volume_level", "current_position", "mode"])
+
+# Invariant instructions; kept byte-identical across requests and placed first
+# so OpenAI's prompt cache can reuse the prefix
+_SYSTEM_PROMPT = """
+You are Nexus AI, an intelligent assistant for Home Assistant smart homes. Your goal is to provide helpful, accurate, and concise responses to user queries about their smart home system.
+
+Guidelines:
+1. Be concise and friendly in your responses.
+2. When the user asks to control devices, respond accordingly and use the ACTION commands below.
+3. For complex multi-step operations, break them down into individual actions.
+4. Be helpful and creative in suggesting automations and routines.
+5. Always prioritize safety and security in your suggestions.
+
+To control Home Assistant devices or create automations, use these special commands:
+- To control a device: <ACTION:CALL_SERVICE domain="light" service="turn_on" data={"entity_id": "light.living_room"}>
+- To create an automation: <ACTION:CREATE_AUTOMATION name="Evening Lights" trigger={"platform": "sun", "event": "sunset"} action={"service": "light.turn_on", "entity_id": "light.living_room"}>
+
+Remember to include these ACTION commands within your response text where appropriate, and I'll execute them for you.
+"""
+
 class NexusAgent:
     """Core AI agent that processes queries and integrates with all components."""
     
-    def __init__(self, database, ha_api):
+    # Prefixes of the fallback messages _call_openai returns on failure
+    _ERROR_RESPONSE_PREFIXES = (
+        "AI service is not available",
+        "I'm sorry, I couldn't generate a response",
+        "I encountered an error communicating",
+    )
+    
+    def __init__(self, database, ha_api, response_cache=None):
         """Initialize the AI agent with components."""
         self.db = database
         self.ha_api = ha_api
+        self.response_cache = response_cache
         self.client = None
+        self.http_client = None
+        # Bound in-flight completions so bursts stay within OpenAI rate limits
+        self.openai_semaphore = asyncio.Semaphore(int(os.environ.get("OPENAI_MAX_CONCURRENCY", "4")))
+        # Non-interactive queries waiting to go out through the Batch API
+        self.batch_size = int(os.environ.get("OPENAI_BATCH_SIZE", "50"))
+        self.batch_interval = float(os.environ.get("OPENAI_BATCH_INTERVAL", "60"))
+        self._batch_queue = deque()
+        self._batch_ready = asyncio.Event()
+        self._batch_flush_task = None
+        self._batch_tasks = set()
+        # Short-lived index of the HA state list shared by concurrent queries
+        self.states_ttl = float(os.environ.get("HA_STATES_TTL", "2"))
+        self._states_cache = (0.0, None)
+        self._states_lock = asyncio.Lock()
+        # Cap on entities sent to the model, ranked by embedding similarity to
+        # the query; 0 sends every entity in the matched domains
+        self.entity_top_k = int(os.environ.get("AGENT_ENTITY_TOP_K", "8"))
+        self.embedding_model = os.environ.get("AGENT_EMBEDDING_MODEL", "text-embedding-3-small")
+        self._entity_embeddings = {}
         self.initialize_ai()
     
     def initialize_ai(self):
@@ -46,11 +131,22 @@ class NexusAgent:
                 self.model_type = "none"
                 self.model_name = "none"
             else:
-                self.client = OpenAI(api_key=openai_api_key)
+                # One pooled HTTP client for every request, so connections
+                # (and their TLS handshakes) are reused across queries
+                self.http_client = httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+                )
+                self.client = AsyncOpenAI(api_key=openai_api_key, http_client=self.http_client)
                 self.model_type = "openai"
                 self.model_name = "gpt-4o"  # The newest OpenAI model is "gpt-4o" which was released May 13, 2024
                 logger.info("Using OpenAI API")
     
+    async def close(self):
+        """Close the pooled OpenAI HTTP connections."""
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+    
     async def process_query(self, query: str, context: Optional[Dict[str, Any]] = None) -> str:
         """Process a user query with context and memory."""
         # Check if AI is available
@@ -58,27 +154,23 @@ class NexusAgent:
             return "AI is not available. Please configure an OpenAI API key or local model in the add-on settings."
         
         try:
-            # Get current Home Assistant state
-            ha_state = await self.ha_api.get_states()
-            
             # Prepare context object
             if not context:
                 context = {}
             
-            # Extract relevant HA states based on the query
-            relevant_states = self._extract_relevant_ha_states(ha_state, query)
+            # Answer near-duplicate questions from the semantic cache, fetching
+            # Home Assistant state at the same time in case it misses
+            use_cache = self._use_cache(context)
+            cache_namespace = context.get("session_id", "default")
+            cached_response, state_index = await self._prefetch(query, use_cache, cache_namespace)
+            if cached_response is not None:
+                return cached_response
             
             # Build system prompt
             system_prompt = self._build_system_prompt(context)
             
-            # Build user prompt with context
-            user_prompt = f"User question: {query}\n\n"
-            user_prompt += "Current Home Assistant state:\n"
-            user_prompt += relevant_states
-            
-            # Add any additional context from the request
-            if context and context.get("additional_context"):
-                user_prompt += f"\nAdditional context:\n{context.get('additional_context')}"
+            # Build user prompt with the relevant Home Assistant state
+            user_prompt = await self._build_user_prompt(query, context, state_index)
             
             # Call the AI
             if self.model_type == "openai":
@@ -88,101 +180,318 @@ class NexusAgent:
             else:
                 return "AI is not available. Please configure an OpenAI API key or local model in the add-on settings."
             
-            # Process any actions in the response
-            await self._process_actions(response)
-            
-            # Clean the response (remove action commands)
-            cleaned_response = self._clean_response(response)
-            
-            return cleaned_response
+            # Execute actions, strip them from the reply and cache it
+            return await self._finish_response(query, response, use_cache, cache_namespace)
         
         except Exception as e:
             logger.error(f"Error processing query: {str(e)}")
             return f"I'm sorry, I encountered an error processing your request: {str(e)}"
     
-    def _extract_relevant_ha_states(self, ha_state: List[Dict[str, Any]], query: str) -> str:
-        """Extract relevant Home Assistant states based on the query."""
-        # This is a simple implementation - in a more advanced version,
-        # we could use embeddings to find the most relevant entities
-        
-        # Convert query to lowercase for case-insensitive matching
-        query_lower = query.lower()
-        
-        # Keywords to always include certain domains
-        domain_keywords = {
-            "light": ["light", "lights", "lamp", "lamps", "on", "off", "brightness"],
-            "switch": ["switch", "switches", "outlet", "outlets", "on", "off"],
-            "sensor": ["temperature", "humidity", "sensor", "reading", "motion", "presence"],
-            "climate": ["thermostat", "heat", "ac", "temperature", "cool"],
-            "media_player": ["tv", "music", "play", "pause", "volume", "media", "movie"],
-            "cover": ["blinds", "shades", "curtains", "garage", "door", "cover"],
-            "person": ["person", "people", "who", "home", "away", "present"],
-            "weather": ["weather", "forecast", "temperature", "rain", "wind", "snow"],
-            "automation": ["automation", "automatic", "trigger", "scene"],
-        }
-        
-        # Determine which domains to include
-        domains_to_include = []
-        for domain, keywords in domain_keywords.items():
-            if any(keyword in query_lower for keyword in keywords):
-                domains_to_include.append(domain)
+    async def process_query_stream(self, query: str, context: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """Process a user query, yielding the response text as the model generates it."""
+        if self.model_type != "openai":
+            # Only the OpenAI backend can stream; everything else arrives in one piece
+            yield await self.process_query(query, context)
+            return
         
-        # If no specific domains matched, include common important ones
-        if not domains_to_include:
-            domains_to_include = ["light", "switch", "sensor", "climate", "person"]
+        try:
+            if not context:
+                context = {}
+            
+            use_cache = self._use_cache(context)
+            cache_namespace = context.get("session_id", "default")
+            cached_response, state_index = await self._prefetch(query, use_cache, cache_namespace)
+            if cached_response is not None:
+                yield cached_response
+                return
+            
+            system_prompt = self._build_system_prompt(context)
+            user_prompt = await self._build_user_prompt(query, context, state_index)
+            
+            # Read the model's stream in its own task so the OpenAI permit is
+            # released as soon as generation ends, however slowly the client
+            # consumes the reply
+            deltas: asyncio.Queue = asyncio.Queue()
+            
+            async def produce():
+                try:
+                    async with self.openai_semaphore:
+                        stream = await self.client.chat.completions.create(
+                            model=self.model_name,
+                            messages=[
+                                {"role": "system", "content": system_prompt},
+                                {"role": "user", "content": user_prompt}
+                            ],
+                            temperature=0.7,
+                            max_tokens=1000,
+                            stream=True
+                        )
+                        async for chunk in stream:
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                deltas.put_nowait(chunk.choices[0].delta.content)
+                finally:
+                    deltas.put_nowait(None)
+            
+            producer = asyncio.create_task(produce())
+            response = ""
+            pending = ""
+            action_tasks = []
+            scan_pos = 0
+            try:
+                while (delta := await deltas.get()) is not None:
+                    response += delta
+                    pending += delta
+                    
+                    # Fire each ACTION as soon as its closing ">" arrives so
+                    # devices respond while the rest of the reply is generated
+                    for match in _ACTION_RE.finditer(response, scan_pos):
+                        action_tasks.append(asyncio.create_task(self._run_actions([match.groups()])))
+                        scan_pos = match.end()
+                    
+                    # Hold back a possibly unfinished <ACTION ...> command until
+                    # its closing ">" arrives so it is never sent half-cleaned
+                    cut = pending.rfind("<")
+                    if cut != -1 and ">" not in pending[cut:]:
+                        ready, pending = pending[:cut], pending[cut:]
+                    else:
+                        ready, pending = pending, ""
+                    
+                    if ready:
+                        yield self._clean_response(ready)
+                
+                # Surface any error raised while reading the stream
+                await producer
+                
+                if pending:
+                    yield self._clean_response(pending)
+            finally:
+                # A client that disconnects closes the generator early; stop
+                # reading the model and let already-fired actions complete
+                producer.cancel()
+                await asyncio.gather(*action_tasks, return_exceptions=True)
+            
+            await self._finish_response(query, response, use_cache, cache_namespace, run_actions=False)
+        
+        except Exception as e:
+            logger.error(f"Error streaming query: {str(e)}")
+            yield f"I'm sorry, I encountered an error processing your request: {str(e)}"
+    
+    async def enqueue_query(self, query: str, context: Optional[Dict[str, Any]] = None) -> "asyncio.Future[str]":
+        """
+        Queue a non-interactive query for OpenAI's Batch API.
+        
+        Batched requests cost half as much but can take up to 24 hours, so this
+        is only for background work such as automation suggestions. The reply
+        is returned raw: ACTION commands in it are not executed.
+        
+        Args:
+            query: The user query
+            context: Optional context, as for process_query
         
-        # Filter entities by domain and prepare output
-        relevant_entities = []
+        Returns:
+            Future resolved with the model's reply once the batch completes
+        """
+        future = asyncio.get_running_loop().create_future()
+        
+        if self.model_type != "openai":
+            future.set_result("AI service is not available. Please check your OpenAI API key.")
+            return future
+        
+        if not context:
+            context = {}
+        
+        state_index = await self._get_state_index()
+        user_prompt = await self._build_user_prompt(query, context, state_index)
+        self._batch_queue.append((future, {
+            "custom_id": uuid.uuid4().hex,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model_name,
+                "messages": [
+                    {"role": "system", "content": self._build_system_prompt(context)},
+                    {"role": "user", "content": user_prompt}
+                ],
+                "temperature": 0.7,
+                "max_tokens": 1000
+            }
+        }))
+        
+        if len(self._batch_queue) >= self.batch_size:
+            self._batch_ready.set()
+        if self._batch_flush_task is None or self._batch_flush_task.done():
+            self._batch_flush_task = asyncio.create_task(self._flush_batches())
+        
+        return future
+    
+    def _spawn(self, coro) -> None:
+        """Run a background coroutine, keeping a reference until it finishes."""
+        task = asyncio.create_task(coro)
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+    
+    def _use_cache(self, context: Dict[str, Any]) -> bool:
+        """Whether the semantic cache may answer a query with this context."""
+        # Requests carrying their own context/instructions always go to the model
+        return (
+            self.response_cache is not None
+            and not context.get("additional_context")
+            and not context.get("system_instructions")
+        )
+    
+    async def _prefetch(self, query: str, use_cache: bool,
+                        cache_namespace: str) -> Tuple[Optional[str], Optional[List[Tuple[str, str, str]]]]:
+        """Look up the semantic cache and fetch Home Assistant state concurrently."""
+        states_task = asyncio.create_task(self._get_state_index())
+        
+        if use_cache:
+            # Chroma embeds and searches synchronously; keep it off the event loop
+            cached_response = await asyncio.to_thread(self.response_cache.lookup, query, cache_namespace)
+            if cached_response is not None:
+                states_task.cancel()
+                return cached_response, None
+        
+        return None, await states_task
+    
+    async def _get_state_index(self) -> List[Tuple[str, str, str]]:
+        """Get the indexed HA states, reusing a fetch made within the last states_ttl seconds."""
+        now = time.monotonic()
+        fetched_at, index = self._states_cache
+        if index is not None and now - fetched_at < self.states_ttl:
+            return index
+        
+        # Concurrent callers wait for the one fetch in flight instead of each
+        # pulling the whole state list
+        async with self._states_lock:
+            fetched_at, index = self._states_cache
+            if index is not None and now - fetched_at < self.states_ttl:
+                return index
+            
+            index = self._index_states(await self.ha_api.get_states())
+            self._states_cache = (time.monotonic(), index)
+            return index
+    
+    def _index_states(self, ha_state: List[Dict[str, Any]]) -> List[Tuple[str, str, str]]:
+        """Split out each entity's domain and pre-format its prompt text, once per fetch."""
+        index = []
         for entity in ha_state:
             entity_id = entity.get("entity_id", "")
-            domain = entity_id.split(".", 1)[0] if "." in entity_id else ""
+            domain, dot, _ = entity_id.partition(".")
+            if not dot:
+                continue
             
-            if domain in domains_to_include:
-                state = entity.get("state", "")
-                attributes = entity.get("attributes", {})
-                friendly_name = attributes.get("friendly_name", entity_id)
-                
-                relevant_entities.append({
-                    "entity_id": entity_id,
-                    "state": state,
-                    "friendly_name": friendly_name,
-                    "attributes": attributes
-                })
-        
-        # Format entities as text
-        if not relevant_entities:
+            state = entity.get("state", "")
+            attributes = entity.get("attributes") or {}
+            friendly_name = attributes.get("friendly_name", entity_id)
+            
+            # Format entities as text, with key attributes if present; the
+            # label is what gets embedded for relevance ranking
+            label = f"{friendly_name} ({entity_id})"
+            text = f"- {label}: {state}\n" + "".join(
+                f"  - {key}: {value}\n"
+                for key, value in attributes.items()
+                if key in _IMPORTANT_ATTRS
+            )
+            index.append((domain, label, text))
+        
+        return index
+    
+    async def _build_user_prompt(self, query: str, context: Dict[str, Any],
+                                 state_index: List[Tuple[str, str, str]]) -> str:
+        """Build the user prompt from the query and current Home Assistant state."""
+        # Extract relevant HA states based on the query
+        relevant_states = await self._extract_relevant_ha_states(state_index, query)
+        
+        user_prompt = f"User question: {query}\n\n"
+        user_prompt += "Current Home Assistant state:\n"
+        user_prompt += relevant_states
+        
+        # Add any additional context from the request
+        if context and context.get("additional_context"):
+            user_prompt += f"\nAdditional context:\n{context.get('additional_context')}"
+        
+        return user_prompt
+    
+    async def _finish_response(self, query: str, response: str, use_cache: bool, cache_namespace: str,
+                               run_actions: bool = True) -> str:
+        """Run the actions in a model reply, then clean and cache it."""
+        # Process any actions in the response
+        if run_actions:
+            await self._process_actions(response)
+        
+        # Clean the response (remove action commands)
+        cleaned_response = self._clean_response(response)
+        
+        # Only cache real answers without actions; replaying a cached reply
+        # must never skip actions the model asked us to execute
+        if (use_cache and "<ACTION:" not in response
+                and not response.startswith(self._ERROR_RESPONSE_PREFIXES)):
+            # Store in the background so the reply isn't held up by embedding it
+            asyncio.get_running_loop().run_in_executor(
+                None, self.response_cache.store, query, cleaned_response, cache_namespace
+            )
+        
+        return cleaned_response
+    
+    async def _extract_relevant_ha_states(self, state_index: List[Tuple[str, str, str]], query: str) -> str:
+        """Extract relevant Home Assistant states based on the query."""
+        # Determine which domains to include from the keywords in the query
+        domains_to_include = set()
+        for match in _KEYWORD_RE.finditer(query):
+            domains_to_include |= _KEYWORD_DOMAINS[match.group(1).lower()]
+        
+        # If no specific domains matched, include common important ones
+        if not domains_to_include:
+            domains_to_include = _DEFAULT_DOMAINS
+        
+        # Filter the pre-formatted entities by domain, then keep only the
+        # ones closest to the query
+        entries = [entry for entry in state_index if entry[0] in domains_to_include]
+        entries = await self._rank_entities(entries, query)
+        
+        if not entries:
             return "No relevant entities found."
         
-        formatted_text = ""
-        for entity in relevant_entities:
-            formatted_text += f"- {entity['friendly_name']} ({entity['entity_id']}): {entity['state']}\n"
-            
-            # Add key attributes if present
-            if entity['attributes']:
-                for key, value in entity['attributes'].items():
-                    if key in ['temperature', 'humidity', 'brightness', 'volume_level', 'current_position', 'mode']:
-                        formatted_text += f"  - {key}: {value}\n"
+        return "".join(text for _, _, text in entries)
+    
+    async def _rank_entities(self, entries: List[Tuple[str, str, str]], query: str) -> List[Tuple[str, str, str]]:
+        """
+        Keep the entity_top_k entries whose labels are most similar to the query.
+        
+        Labels are embedded once and reused across queries, so a typical query
+        costs a single embedding of the query text. Falls back to returning all
+        entries if ranking is disabled or the embedding call fails.
         
-        return formatted_text
+        Args:
+            entries: Indexed (domain, label, text) entries to choose from
+            query: The user query
+        
+        Returns:
+            The selected entries, in their original order
+        """
+        if self.model_type != "openai" or not self.entity_top_k or len(entries) <= self.entity_top_k:
+            return entries
+        
+        try:
+            missing = list({label for _, label, _ in entries if label not in self._entity_embeddings})
+            result = await self.client.embeddings.create(model=self.embedding_model, input=[query] + missing)
+            vectors = [item.embedding for item in result.data]
+            
+            for label, vector in zip(missing, vectors[1:]):
+                self._entity_embeddings[label] = np.asarray(vector, dtype=np.float32)
+            
+            # OpenAI embeddings are unit length, so the dot product is the cosine
+            matrix = np.stack([self._entity_embeddings[label] for _, label, _ in entries])
+            scores = matrix @ np.asarray(vectors[0], dtype=np.float32)
+            top = np.argpartition(scores, -self.entity_top_k)[-self.entity_top_k:]
+            return [entries[i] for i in sorted(top)]
+        except Exception as e:
+            logger.warning(f"Failed to rank entities by relevance: {str(e)}")
+            return entries
     
     def _build_system_prompt(self, context: Dict[str, Any]) -> str:
         """Build the system prompt with instructions for the AI."""
-        system_prompt = """
-You are Nexus AI, an intelligent assistant for Home Assistant smart homes. Your goal is to provide helpful, accurate, and concise responses to user queries about their smart home system.
-
-Guidelines:
-1. Be concise and friendly in your responses.
-2. When the user asks to control devices, respond accordingly and use the ACTION commands below.
-3. For complex multi-step operations, break them down into individual actions.
-4. Be helpful and creative in suggesting automations and routines.
-5. Always prioritize safety and security in your suggestions.
-
-To control Home Assistant devices or create automations, use these special commands:
-- To control a device: <ACTION:CALL_SERVICE domain="light" service="turn_on" data={"entity_id": "light.living_room"}>
-- To create an automation: <ACTION:CREATE_AUTOMATION name="Evening Lights" trigger={"platform": "sun", "event": "sunset"} action={"service": "light.turn_on", "entity_id": "light.living_room"}>
-
-Remember to include these ACTION commands within your response text where appropriate, and I'll execute them for you.
-        """
+        system_prompt = _SYSTEM_PROMPT
         
         # Add any custom system instructions from context
         if context and context.get("system_instructions"):
@@ -198,15 +507,16 @@ Remember to include these ACTION commands within your response text where approp
                 logger.error("OpenAI client not initialized")
                 return "AI service is not available. Please check your OpenAI API key."
             
-            response = self.client.chat.completions.create(
-                model=self.model_name,  # gpt-4o is the newest model
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=1000
-            )
+            async with self.openai_semaphore:
+                response = await self.client.chat.completions.create(
+                    model=self.model_name,  # gpt-4o is the newest model
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    temperature=0.7,
+                    max_tokens=1000
+                )
             
             if response.choices and len(response.choices) > 0:
                 return response.choices[0].message.content
@@ -218,6 +528,69 @@ Remember to include these ACTION commands within your response text where approp
             logger.error(f"Error calling OpenAI API: {str(e)}")
             return f"I encountered an error communicating with the AI service: {str(e)}"
     
+    async def _flush_batches(self) -> None:
+        """Submit queued queries as batches every interval or whenever a batch fills up."""
+        while self._batch_queue:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.batch_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            
+            items = [self._batch_queue.popleft()
+                     for _ in range(min(self.batch_size, len(self._batch_queue)))]
+            
+            # Another full batch may already be waiting; submit it without
+            # sitting out a whole interval
+            if len(self._batch_queue) >= self.batch_size:
+                self._batch_ready.set()
+            futures = {request["custom_id"]: future for future, request in items}
+            jsonl = b"\n".join(orjson.dumps(request) for _, request in items)
+            
+            try:
+                batch_file = await self.client.files.create(file=("batch.jsonl", jsonl), purpose="batch")
+                batch = await self.client.batches.create(
+                    input_file_id=batch_file.id,
+                    endpoint="/v1/chat/completions",
+                    completion_window="24h"
+                )
+                logger.info(f"Submitted OpenAI batch {batch.id} with {len(items)} queries")
+                self._spawn(self._collect_batch(batch.id, futures))
+            except Exception as e:
+                logger.error(f"Error submitting OpenAI batch: {str(e)}")
+                self._resolve_batch(futures, {}, f"I encountered an error communicating with the AI service: {str(e)}")
+    
+    async def _collect_batch(self, batch_id: str, futures: Dict[str, "asyncio.Future[str]"]) -> None:
+        """Poll a submitted batch and resolve its futures with the replies."""
+        poll_interval = float(os.environ.get("OPENAI_BATCH_POLL_INTERVAL", "60"))
+        
+        try:
+            while True:
+                batch = await self.client.batches.retrieve(batch_id)
+                if batch.status in ("completed", "failed", "expired", "cancelled"):
+                    break
+                await asyncio.sleep(poll_interval)
+            
+            replies = {}
+            if batch.output_file_id:
+                output = await self.client.files.content(batch.output_file_id)
+                for line in output.text.splitlines():
+                    result = orjson.loads(line)
+                    body = (result.get("response") or {}).get("body") or {}
+                    if body.get("choices"):
+                        replies[result["custom_id"]] = body["choices"][0]["message"]["content"]
+            
+            self._resolve_batch(futures, replies, f"I'm sorry, I couldn't generate a response (batch {batch.status}).")
+        except Exception as e:
+            logger.error(f"Error collecting OpenAI batch {batch_id}: {str(e)}")
+            self._resolve_batch(futures, {}, f"I encountered an error communicating with the AI service: {str(e)}")
+    
+    def _resolve_batch(self, futures: Dict[str, "asyncio.Future[str]"], replies: Dict[str, str], fallback: str) -> None:
+        """Resolve each queued query with its reply, or the fallback message."""
+        for custom_id, future in futures.items():
+            if not future.done():
+                future.set_result(replies.get(custom_id, fallback))
+    
     def _call_local_model(self, system_prompt: str, user_prompt: str) -> str:
         """Call a local LLM to generate a response."""
         # This is a placeholder for local model integration
@@ -227,14 +600,19 @@ Remember to include these ACTION commands within your response text where approp
     async def _process_actions(self, response: str) -> None:
         """Process any actions indicated in the AI response."""
         # Find all ACTION commands in the response
-        action_calls = re.findall(r'<ACTION:([A-Z_]+)\s+([^>]+)>', response)
+        await self._run_actions(_ACTION_RE.findall(response))
+    
+    async def _run_actions(self, action_calls: List[Tuple[str, str]]) -> None:
+        """Execute parsed (action type, params) ACTION commands."""
+        # Service calls are collected and sent to HA together after parsing
+        service_calls = []
         
         for action_type, action_params in action_calls:
             try:
                 # Parse parameters from the action string
                 params = {}
                 # Simple parsing for key="value" pairs
-                for match in re.finditer(r'(\w+)=(?:"([^"]*)"|\{([^}]*)\})', action_params):
+                for match in _ACTION_PARAM_RE.finditer(action_params):
                     key = match.group(1)
                     if match.group(2) is not None:
                         # String value
@@ -245,19 +623,14 @@ Remember to include these ACTION commands within your response text where approp
                             json_str = match.group(3)
                             # Ensure proper JSON format (convert single quotes, add quotes to keys)
                             json_str = json_str.replace("'", '"')
-                            json_str = re.sub(r'(\w+):', r'"\1":', json_str)
-                            params[key] = json.loads('{' + json_str + '}')
-                        except json.JSONDecodeError:
+                            json_str = _JSON_KEY_RE.sub(r'"\1":', json_str)
+                            params[key] = orjson.loads('{' + json_str + '}')
+                        except orjson.JSONDecodeError:
                             logger.error(f"Invalid JSON in action parameters: {match.group(3)}")
                 
                 # Process the action based on its type
                 if action_type == "CALL_SERVICE" and "domain" in params and "service" in params:
-                    await self.ha_api.call_service(
-                        params["domain"], 
-                        params["service"], 
-                        params.get("data", {})
-                    )
-                    logger.info(f"Called service {params['domain']}.{params['service']}")
+                    service_calls.append((params["domain"], params["service"], params.get("data", {})))
                 
                 elif action_type == "CREATE_AUTOMATION" and "name" in params:
                     # Extract parameters for automation
@@ -284,6 +657,19 @@ Remember to include these ACTION commands within your response text where approp
             
             except Exception as e:
                 logger.error(f"Error processing action {action_type}: {str(e)}")
+        
+        if not service_calls:
+            return
+        
+        results = await asyncio.gather(
+            *(self.ha_api.call_service(domain, service, data) for domain, service, data in service_calls),
+            return_exceptions=True
+        )
+        for (domain, service, _), result in zip(service_calls, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error processing action CALL_SERVICE: {str(result)}")
+            else:
+                logger.info(f"Called service {domain}.{service}")
     
     def _clean_response(self, response: str) -> str:
         """Remove action commands from the response."""
@@ -297,5 +683,5 @@ Remember to include these ACTION commands within your response text where approp
             return ""
         
         # Replace action patterns with descriptive text
-        cleaned = re.sub(r'<ACTION:[A-Z_]+\s+[^>]+>', replace_action, response)
+        cleaned = _ACTION_RE.sub(replace_action, response)
         return cleaned
\ No newline at end of file
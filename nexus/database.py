@@ -2,20 +2,45 @@
 Database service for Nexus AI
 """
 import os
+import re
 import logging
-import json
 import sqlite3
 import hashlib
+import hmac
 import secrets
+import threading
+from collections import deque
 from typing import Dict, List, Optional, Any, Tuple, Union
 from datetime import datetime
 import time
 from pathlib import Path
 
+import orjson
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Cached marker for a setting that has no row
+_MISSING = object()
+
+# Insert a pattern, or fold this detection into the existing one;
+# confidence becomes the running average over all detections
+_UPSERT_PATTERN = """
+    INSERT INTO patterns
+    (name, pattern_type, entities, data, confidence, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT (name, pattern_type)
+    DO UPDATE SET entities = excluded.entities, data = excluded.data,
+        confidence = (confidence * times_detected + excluded.confidence) / (times_detected + 1),
+        times_detected = times_detected + 1,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+def _dumps(value: Any) -> str:
+    """Serialize a value for one of the JSON text columns."""
+    return orjson.dumps(value).decode()
+
 class DatabaseService:
     """Service for interacting with the database."""
     
@@ -30,21 +55,32 @@ class DatabaseService:
         
         # Configure SQLite database
         self.db_path = os.path.join(self.data_dir, "nexus.db")
-        self.db_connection = None
+        self._local = threading.local()
+        self.memory_fts = False
+        
+        # Settings and the HA config are read far more often than written;
+        # keep them in memory for a short while, dropped by their setters
+        self.cache_ttl = float(os.environ.get("DB_CACHE_TTL", "30"))
+        self._settings_cache: Dict[str, Tuple[float, Any]] = {}
+        self._settings_all_cache: Optional[Tuple[float, Dict[str, str]]] = None
+        self._ha_config_cache: Optional[Tuple[float, Optional[Dict[str, Any]]]] = None
+        
+        # State history rows are queued and written in batches by a background
+        # thread, so bursts of state changes don't each pay for a commit
+        self.state_flush_interval = float(os.environ.get("DB_STATE_FLUSH_INTERVAL", "1"))
+        self.state_flush_size = int(os.environ.get("DB_STATE_FLUSH_SIZE", "500"))
+        self._state_queue: deque = deque()
+        self._state_lock = threading.Lock()
+        self._state_flush_needed = threading.Event()
         
         # Initialize database
         self._init_sqlite()
+        
+        threading.Thread(target=self._flush_loop, name="nexus-state-flush", daemon=True).start()
     
     def _init_sqlite(self):
         """Initialize SQLite database."""
         try:
-            # Create connection
-            self.db_connection = sqlite3.connect(self.db_path)
-            self.db_connection.row_factory = sqlite3.Row
-            
-            # Enable foreign keys
-            self.db_connection.execute("PRAGMA foreign_keys = ON")
-            
             # Create tables if they don't exist
             self._create_tables()
             
@@ -53,6 +89,34 @@ class DatabaseService:
             logger.error(f"Error initializing database: {str(e)}")
             raise
     
+    @property
+    def db_connection(self) -> sqlite3.Connection:
+        """
+        This thread's database connection, opened on first use.
+        
+        sqlite3 connections can't be shared between threads, so each thread
+        (the event loop, or a worker running a blocking call) gets its own.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Keep more prepared statements around than the default 128
+            connection = sqlite3.connect(self.db_path, cached_statements=256)
+            connection.row_factory = sqlite3.Row
+            
+            # Enable foreign keys
+            connection.execute("PRAGMA foreign_keys = ON")
+            
+            # WAL lets readers run alongside the writer, and with
+            # synchronous=NORMAL a commit no longer fsyncs the whole database
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute("PRAGMA temp_store = MEMORY")
+            connection.execute("PRAGMA mmap_size = 268435456")
+            connection.execute("PRAGMA cache_size = -65536")
+            
+            self._local.connection = connection
+        return connection
+    
     def _create_tables(self):
         """Create database tables if they don't exist."""
         cursor = self.db_connection.cursor()
@@ -144,6 +208,9 @@ class DatabaseService:
                 )
             """)
             
+            # Full-text index over memories, kept in sync by triggers
+            self._create_memory_fts(cursor)
+            
             # Patterns table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS patterns (
@@ -159,6 +226,43 @@ class DatabaseService:
                 )
             """)
             
+            # One row per (name, pattern_type), the conflict target of save_pattern
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ix_patterns_name_type'")
+            if cursor.fetchone() is None:
+                # Older databases can hold duplicate pairs; fold each group into
+                # its newest row so the unique index can be built
+                cursor.execute("""
+                    UPDATE patterns SET times_detected = (
+                        SELECT SUM(p.times_detected) FROM patterns p
+                        WHERE p.name = patterns.name AND p.pattern_type = patterns.pattern_type
+                    )
+                    WHERE id IN (
+                        SELECT MAX(id) FROM patterns GROUP BY name, pattern_type HAVING COUNT(*) > 1
+                    )
+                """)
+                cursor.execute("""
+                    DELETE FROM patterns WHERE id NOT IN (
+                        SELECT MAX(id) FROM patterns GROUP BY name, pattern_type
+                    )
+                """)
+                cursor.execute("""
+                    CREATE UNIQUE INDEX ix_patterns_name_type ON patterns (name, pattern_type)
+                """)
+            
+            # Indexes for the list filters and the per-entity history read
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS ix_entities_domain_important ON entities (domain, is_important)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS ix_entity_states_entity_ts ON entity_states (entity_id, timestamp DESC)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS ix_automations_is_suggested ON automations (is_suggested)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS ix_patterns_type_confidence ON patterns (pattern_type, confidence)
+            """)
+            
             # Commit changes
             self.db_connection.commit()
             logger.info("Database tables created/verified")
@@ -171,17 +275,58 @@ class DatabaseService:
         finally:
             cursor.close()
     
+    def _create_memory_fts(self, cursor):
+        """Create the FTS5 index over memories, if SQLite was built with FTS5."""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'memories_fts'")
+        exists = cursor.fetchone() is not None
+        
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts
+                USING fts5(key, value, content='memories', content_rowid='id')
+            """)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 not available, memory search will scan the table: {str(e)}")
+            return
+        
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS memories_fts_insert AFTER INSERT ON memories BEGIN
+                INSERT INTO memories_fts (rowid, key, value) VALUES (new.id, new.key, new.value);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS memories_fts_delete AFTER DELETE ON memories BEGIN
+                INSERT INTO memories_fts (memories_fts, rowid, key, value) VALUES ('delete', old.id, old.key, old.value);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS memories_fts_update AFTER UPDATE ON memories BEGIN
+                INSERT INTO memories_fts (memories_fts, rowid, key, value) VALUES ('delete', old.id, old.key, old.value);
+                INSERT INTO memories_fts (rowid, key, value) VALUES (new.id, new.key, new.value);
+            END
+        """)
+        
+        # Index memories saved before the FTS table existed
+        if not exists:
+            cursor.execute("INSERT INTO memories_fts (memories_fts) VALUES ('rebuild')")
+        
+        self.memory_fts = True
+    
     def get_setting(self, key: str, default: Optional[str] = None) -> Optional[str]:
         """Get a setting value by key."""
+        cached = self._settings_cache.get(key)
+        if cached and time.monotonic() - cached[0] < self.cache_ttl:
+            return default if cached[1] is _MISSING else cached[1]
+        
         cursor = self.db_connection.cursor()
         
         try:
             cursor.execute("SELECT value FROM settings WHERE key = ?", (key,))
             row = cursor.fetchone()
             
-            if row:
-                return row["value"]
-            return default
+            value = row["value"] if row else _MISSING
+            self._settings_cache[key] = (time.monotonic(), value)
+            return default if value is _MISSING else value
         
         except Exception as e:
             logger.error(f"Error getting setting {key}: {str(e)}")
@@ -200,10 +345,12 @@ class DatabaseService:
                 INSERT INTO settings (key, value, updated_at) 
                 VALUES (?, ?, CURRENT_TIMESTAMP)
                 ON CONFLICT (key) 
-                DO UPDATE SET value = ?, updated_at = CURRENT_TIMESTAMP
-            """, (key, value, value))
+                DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+            """, (key, value))
             
             self.db_connection.commit()
+            self._settings_cache.pop(key, None)
+            self._settings_all_cache = None
             return True
         
         except Exception as e:
@@ -216,11 +363,17 @@ class DatabaseService:
     
     def get_all_settings(self) -> Dict[str, str]:
         """Get all settings as a dictionary."""
+        cached = self._settings_all_cache
+        if cached and time.monotonic() - cached[0] < self.cache_ttl:
+            return dict(cached[1])
+        
         cursor = self.db_connection.cursor()
         
         try:
             cursor.execute("SELECT key, value FROM settings")
-            return {row["key"]: row["value"] for row in cursor.fetchall()}
+            settings = {row["key"]: row["value"] for row in cursor.fetchall()}
+            self._settings_all_cache = (time.monotonic(), settings)
+            return dict(settings)
         
         except Exception as e:
             logger.error(f"Error getting all settings: {str(e)}")
@@ -249,6 +402,7 @@ class DatabaseService:
             """, (url, token_hash))
             
             self.db_connection.commit()
+            self._ha_config_cache = None
             return True
         
         except Exception as e:
@@ -261,6 +415,10 @@ class DatabaseService:
     
     def get_active_ha_config(self) -> Optional[Dict[str, Any]]:
         """Get the active Home Assistant configuration."""
+        cached = self._ha_config_cache
+        if cached and time.monotonic() - cached[0] < self.cache_ttl:
+            return dict(cached[1]) if cached[1] else None
+        
         cursor = self.db_connection.cursor()
         
         try:
@@ -271,17 +429,17 @@ class DatabaseService:
             """)
             
             row = cursor.fetchone()
-            if not row:
-                return None
-            
-            return {
+            config = {
                 "id": row["id"],
                 "url": row["url"],
                 "token_hash": row["token_hash"],
                 "last_connected_at": row["last_connected_at"],
                 "version": row["version"],
                 "location_name": row["location_name"]
-            }
+            } if row else None
+            
+            self._ha_config_cache = (time.monotonic(), config)
+            return dict(config) if config else None
         
         except Exception as e:
             logger.error(f"Error getting active HA config: {str(e)}")
@@ -312,6 +470,7 @@ class DatabaseService:
             """, (version, location_name, config["id"]))
             
             self.db_connection.commit()
+            self._ha_config_cache = None
             return True
         
         except Exception as e:
@@ -324,12 +483,23 @@ class DatabaseService:
     
     def verify_ha_token(self, token: str) -> bool:
         """Verify if a token matches the stored hash."""
+        # The config lookup is served from the in-memory cache
         config = self.get_active_ha_config()
         if not config:
             return False
         
-        token_hash = self._hash_token(token)
-        return token_hash == config["token_hash"]
+        # Re-hash with the stored salt (hashing with a fresh salt never matches)
+        # and compare in constant time. Hashes saved before the switch to
+        # BLAKE2b have no algorithm prefix; they are replaced with a BLAKE2b
+        # hash the next time the config is saved.
+        parts = config["token_hash"].split(":")
+        if len(parts) == 3:
+            _, salt, stored_hash = parts
+            token_hash = self._token_digest(token, salt)
+        else:
+            salt, stored_hash = parts[0], parts[-1]
+            token_hash = hashlib.sha256((token + salt).encode()).hexdigest()
+        return hmac.compare_digest(token_hash, stored_hash)
     
     def save_entity(self, entity_id: str, friendly_name: Optional[str], domain: str, 
                     state: str, attributes: Dict[str, Any], is_important: bool = False) -> bool:
@@ -337,68 +507,167 @@ class DatabaseService:
         cursor = self.db_connection.cursor()
         
         try:
-            # Check if entity exists
-            cursor.execute("SELECT id FROM entities WHERE entity_id = ?", (entity_id,))
-            row = cursor.fetchone()
+            # Insert or update the entity in one statement
+            attributes_json = _dumps(attributes)
+            cursor.execute("""
+                INSERT INTO entities 
+                (entity_id, friendly_name, domain, last_state, attributes, is_important, 
+                 last_updated, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ON CONFLICT (entity_id)
+                DO UPDATE SET friendly_name = excluded.friendly_name, last_state = excluded.last_state,
+                    attributes = excluded.attributes, is_important = excluded.is_important,
+                    last_updated = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            """, (
+                entity_id, 
+                friendly_name, 
+                domain, 
+                state, 
+                attributes_json, 
+                1 if is_important else 0
+            ))
             
-            if row:
-                # Update existing entity
-                entity_db_id = row["id"]
-                cursor.execute("""
-                    UPDATE entities 
-                    SET friendly_name = ?, last_state = ?, attributes = ?, 
-                        is_important = ?, last_updated = CURRENT_TIMESTAMP,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                """, (
-                    friendly_name, 
-                    state, 
-                    json.dumps(attributes), 
-                    1 if is_important else 0,
-                    entity_db_id
-                ))
-            else:
-                # Insert new entity
-                cursor.execute("""
-                    INSERT INTO entities 
-                    (entity_id, friendly_name, domain, last_state, attributes, is_important, 
-                     last_updated, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                """, (
-                    entity_id, 
-                    friendly_name, 
-                    domain, 
-                    state, 
-                    json.dumps(attributes), 
-                    1 if is_important else 0
-                ))
-                cursor.execute("SELECT last_insert_rowid()")
-                entity_db_id = cursor.fetchone()[0]
+            self.db_connection.commit()
             
             # Save state history
-            cursor.execute("""
+            self._queue_states([(state, attributes_json, entity_id)])
+            return True
+        
+        except Exception as e:
+            logger.error(f"Error saving entity {entity_id}: {str(e)}")
+            self.db_connection.rollback()
+            return False
+        
+        finally:
+            cursor.close()
+    
+    def save_entities_bulk(self, entities: List[Dict[str, Any]]) -> bool:
+        """
+        Save or update many entities and their states in one transaction.
+        
+        Args:
+            entities: Dicts with entity_id, friendly_name, domain, state,
+                attributes and optionally is_important, as for save_entity
+            
+        Returns:
+            bool: Success status
+        """
+        if not entities:
+            return True
+        
+        cursor = self.db_connection.cursor()
+        
+        try:
+            rows = [
+                (
+                    entity["entity_id"],
+                    entity.get("friendly_name"),
+                    entity["domain"],
+                    entity["state"],
+                    _dumps(entity.get("attributes") or {}),
+                    1 if entity.get("is_important") else 0
+                )
+                for entity in entities
+            ]
+            
+            cursor.executemany("""
+                INSERT INTO entities 
+                (entity_id, friendly_name, domain, last_state, attributes, is_important, 
+                 last_updated, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ON CONFLICT (entity_id)
+                DO UPDATE SET friendly_name = excluded.friendly_name, last_state = excluded.last_state,
+                    attributes = excluded.attributes, is_important = excluded.is_important,
+                    last_updated = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            """, rows)
+            
+            self.db_connection.commit()
+            
+            self._queue_states([(state, attributes_json, entity_id) for entity_id, _, _, state, attributes_json, _ in rows])
+            return True
+        
+        except Exception as e:
+            logger.error(f"Error saving {len(entities)} entities: {str(e)}")
+            self.db_connection.rollback()
+            return False
+        
+        finally:
+            cursor.close()
+    
+    def _queue_states(self, states: List[Tuple[str, str, str]]):
+        """Queue (state, attributes_json, entity_id) history rows for the next flush."""
+        # Stamp the rows now; the flush may run up to an interval later
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        with self._state_lock:
+            self._state_queue.extend(row + (timestamp,) for row in states)
+            if len(self._state_queue) >= self.state_flush_size:
+                self._state_flush_needed.set()
+    
+    def _flush_loop(self):
+        """Flush queued state history every interval, or sooner when the queue fills."""
+        while True:
+            self._state_flush_needed.wait(self.state_flush_interval)
+            self._state_flush_needed.clear()
+            self.flush()
+    
+    def flush(self) -> bool:
+        """
+        Write queued state history rows in one transaction.
+        
+        Returns:
+            bool: Success status
+        """
+        with self._state_lock:
+            if not self._state_queue:
+                return True
+            states = self._state_queue
+            self._state_queue = deque()
+        
+        cursor = self.db_connection.cursor()
+        
+        try:
+            # Resolve each entity's row id inside the insert itself rather than
+            # reading the ids back first
+            cursor.executemany("""
                 INSERT INTO entity_states (entity_id, state, attributes, timestamp)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            """, (entity_db_id, state, json.dumps(attributes)))
+                SELECT id, ?, ?, ? FROM entities WHERE entity_id = ?
+            """, [(state, attributes_json, timestamp, entity_id)
+                  for state, attributes_json, entity_id, timestamp in states])
             
             self.db_connection.commit()
             return True
         
         except Exception as e:
-            logger.error(f"Error saving entity {entity_id}: {str(e)}")
+            logger.error(f"Error flushing {len(states)} entity states: {str(e)}")
             self.db_connection.rollback()
+            
+            # Put the rows back ahead of anything queued since, for the next flush
+            with self._state_lock:
+                states.extend(self._state_queue)
+                self._state_queue = states
             return False
         
         finally:
             cursor.close()
     
-    def get_entities(self, domain: Optional[str] = None, important_only: bool = False) -> List[Dict[str, Any]]:
-        """Get entities with optional filtering."""
+    def get_entities(self, domain: Optional[str] = None, important_only: bool = False,
+                     limit: Optional[int] = None, after_id: Optional[int] = None,
+                     include_attributes: bool = True) -> List[Dict[str, Any]]:
+        """
+        Get entities with optional filtering.
+        
+        Passing limit and/or after_id switches to keyset pagination: rows come
+        ordered by id, starting after after_id (the last id of the previous page).
+        Leaving out attributes skips reading and decoding their JSON.
+        """
         cursor = self.db_connection.cursor()
         
         try:
             # Build query based on filters
-            query = "SELECT * FROM entities WHERE 1=1"
+            columns = "id, entity_id, friendly_name, domain, is_important, last_state, last_updated"
+            if include_attributes:
+                columns += ", attributes"
+            query = f"SELECT {columns} FROM entities WHERE 1=1"
             params = []
             
             if domain:
@@ -408,7 +677,7 @@ class DatabaseService:
             if important_only:
                 query += " AND is_important = 1"
             
-            query += " ORDER BY domain, entity_id"
+            query = self._paginate(query, params, "domain, entity_id", limit, after_id)
             
             # Execute query
             cursor.execute(query, params)
@@ -416,21 +685,23 @@ class DatabaseService:
             # Process results
             entities = []
             for row in cursor.fetchall():
-                try:
-                    attributes = json.loads(row["attributes"]) if row["attributes"] else {}
-                except json.JSONDecodeError:
-                    attributes = {}
-                
-                entities.append({
+                entity = {
                     "id": row["id"],
                     "entity_id": row["entity_id"],
                     "friendly_name": row["friendly_name"],
                     "domain": row["domain"],
                     "is_important": bool(row["is_important"]),
-                    "attributes": attributes,
                     "last_state": row["last_state"],
                     "last_updated": row["last_updated"]
-                })
+                }
+                
+                if include_attributes:
+                    try:
+                        entity["attributes"] = orjson.loads(row["attributes"]) if row["attributes"] else {}
+                    except orjson.JSONDecodeError:
+                        entity["attributes"] = {}
+                
+                entities.append(entity)
             
             return entities
         
@@ -443,34 +714,28 @@ class DatabaseService:
     
     def get_entity_history(self, entity_id: str, limit: int = 100) -> List[Dict[str, Any]]:
         """Get history for a specific entity."""
+        # Include states still waiting in the write queue
+        self.flush()
+        
         cursor = self.db_connection.cursor()
         
         try:
-            # Get entity database ID
-            cursor.execute("SELECT id FROM entities WHERE entity_id = ?", (entity_id,))
-            row = cursor.fetchone()
-            
-            if not row:
-                logger.warning(f"Entity {entity_id} not found")
-                return []
-            
-            entity_db_id = row["id"]
-            
-            # Get historical states
+            # Get historical states, resolving the entity in the same query
             cursor.execute("""
-                SELECT state, attributes, timestamp
-                FROM entity_states
-                WHERE entity_id = ?
-                ORDER BY timestamp DESC
+                SELECT s.state, s.attributes, s.timestamp
+                FROM entity_states s
+                JOIN entities e ON e.id = s.entity_id
+                WHERE e.entity_id = ?
+                ORDER BY s.timestamp DESC
                 LIMIT ?
-            """, (entity_db_id, limit))
+            """, (entity_id, limit))
             
             # Process results
             history = []
             for row in cursor.fetchall():
                 try:
-                    attributes = json.loads(row["attributes"]) if row["attributes"] else {}
-                except json.JSONDecodeError:
+                    attributes = orjson.loads(row["attributes"]) if row["attributes"] else {}
+                except orjson.JSONDecodeError:
                     attributes = {}
                 
                 history.append({
@@ -497,9 +762,9 @@ class DatabaseService:
         
         try:
             # Convert lists to JSON strings
-            triggers_json = json.dumps(triggers)
-            actions_json = json.dumps(actions)
-            conditions_json = json.dumps(conditions) if conditions else None
+            triggers_json = _dumps(triggers)
+            actions_json = _dumps(actions)
+            conditions_json = _dumps(conditions) if conditions else None
             
             # Insert automation
             cursor.execute("""
@@ -527,8 +792,14 @@ class DatabaseService:
         finally:
             cursor.close()
     
-    def get_automations(self, suggested_only: bool = False) -> List[Dict[str, Any]]:
-        """Get all automations with optional filtering."""
+    def get_automations(self, suggested_only: bool = False, limit: Optional[int] = None,
+                        after_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Get all automations with optional filtering.
+        
+        Passing limit and/or after_id switches to keyset pagination: rows come
+        ordered by id, starting after after_id (the last id of the previous page).
+        """
         cursor = self.db_connection.cursor()
         
         try:
@@ -539,7 +810,7 @@ class DatabaseService:
             if suggested_only:
                 query += " AND is_suggested = 1"
             
-            query += " ORDER BY name"
+            query = self._paginate(query, params, "name", limit, after_id)
             
             # Execute query
             cursor.execute(query, params)
@@ -548,10 +819,10 @@ class DatabaseService:
             automations = []
             for row in cursor.fetchall():
                 try:
-                    triggers = json.loads(row["triggers"]) if row["triggers"] else []
-                    conditions = json.loads(row["conditions"]) if row["conditions"] else []
-                    actions = json.loads(row["actions"]) if row["actions"] else []
-                except json.JSONDecodeError:
+                    triggers = orjson.loads(row["triggers"]) if row["triggers"] else []
+                    conditions = orjson.loads(row["conditions"]) if row["conditions"] else []
+                    actions = orjson.loads(row["actions"]) if row["actions"] else []
+                except orjson.JSONDecodeError:
                     triggers, conditions, actions = [], [], []
                 
                 automations.append({
@@ -590,7 +861,8 @@ class DatabaseService:
             """, (1 if is_enabled else 0, automation_id))
             
             self.db_connection.commit()
-            return True
+            # No matched row means the automation does not exist
+            return cursor.rowcount == 1
         
         except Exception as e:
             logger.error(f"Error updating automation {automation_id}: {str(e)}")
@@ -612,7 +884,7 @@ class DatabaseService:
             """, (automation_id,))
             
             self.db_connection.commit()
-            return True
+            return cursor.rowcount == 1
         
         except Exception as e:
             logger.error(f"Error recording trigger for automation {automation_id}: {str(e)}")
@@ -632,11 +904,9 @@ class DatabaseService:
                 INSERT INTO memories (key, value, embedding_id, is_preference, updated_at) 
                 VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
                 ON CONFLICT (key) 
-                DO UPDATE SET value = ?, embedding_id = ?, is_preference = ?, updated_at = CURRENT_TIMESTAMP
-            """, (
-                key, value, embedding_id, 1 if is_preference else 0,
-                value, embedding_id, 1 if is_preference else 0
-            ))
+                DO UPDATE SET value = excluded.value, embedding_id = excluded.embedding_id,
+                    is_preference = excluded.is_preference, updated_at = CURRENT_TIMESTAMP
+            """, (key, value, embedding_id, 1 if is_preference else 0))
             
             self.db_connection.commit()
             return True
@@ -677,8 +947,14 @@ class DatabaseService:
         finally:
             cursor.close()
     
-    def get_all_memories(self, preferences_only: bool = False) -> List[Dict[str, Any]]:
-        """Get all memory items."""
+    def get_all_memories(self, preferences_only: bool = False, limit: Optional[int] = None,
+                         after_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Get all memory items.
+        
+        Passing limit and/or after_id switches to keyset pagination: rows come
+        ordered by id, starting after after_id (the last id of the previous page).
+        """
         cursor = self.db_connection.cursor()
         
         try:
@@ -689,7 +965,7 @@ class DatabaseService:
             if preferences_only:
                 query += " AND is_preference = 1"
             
-            query += " ORDER BY key"
+            query = self._paginate(query, params, "key", limit, after_id)
             
             # Execute query
             cursor.execute(query, params)
@@ -716,6 +992,51 @@ class DatabaseService:
         finally:
             cursor.close()
     
+    def search_memories(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Find memories whose key or value shares words with the query, best match first."""
+        words = re.findall(r'\w+', query)
+        if not words:
+            return []
+        
+        cursor = self.db_connection.cursor()
+        
+        try:
+            if self.memory_fts:
+                # Quote each word so FTS5 operators in user text are taken literally
+                match = " OR ".join('"' + word.replace('"', '""') + '"' for word in words)
+                cursor.execute("""
+                    SELECT m.* FROM memories_fts
+                    JOIN memories m ON m.id = memories_fts.rowid
+                    WHERE memories_fts MATCH ?
+                    ORDER BY rank
+                    LIMIT ?
+                """, (match, limit))
+            else:
+                clauses = " OR ".join("key LIKE ? OR value LIKE ?" for _ in words)
+                params = [f"%{word}%" for word in words for _ in range(2)]
+                cursor.execute(f"SELECT * FROM memories WHERE {clauses} LIMIT ?", (*params, limit))
+            
+            memories = []
+            for row in cursor.fetchall():
+                memories.append({
+                    "id": row["id"],
+                    "key": row["key"],
+                    "value": row["value"],
+                    "embedding_id": row["embedding_id"],
+                    "is_preference": bool(row["is_preference"]),
+                    "created_at": row["created_at"],
+                    "updated_at": row["updated_at"]
+                })
+            
+            return memories
+        
+        except Exception as e:
+            logger.error(f"Error searching memories: {str(e)}")
+            return []
+        
+        finally:
+            cursor.close()
+    
     def delete_memory(self, key: str) -> bool:
         """Delete a memory item."""
         cursor = self.db_connection.cursor()
@@ -739,52 +1060,14 @@ class DatabaseService:
         cursor = self.db_connection.cursor()
         
         try:
-            # Check if a similar pattern exists
-            cursor.execute("""
-                SELECT id, confidence, times_detected FROM patterns 
-                WHERE name = ? AND pattern_type = ?
-            """, (name, pattern_type))
-            
-            row = cursor.fetchone()
-            
-            if row:
-                # Update existing pattern
-                pattern_id = row["id"]
-                old_confidence = float(row["confidence"])
-                times_detected = int(row["times_detected"]) + 1
-                
-                # Adjust confidence (weighted average)
-                new_confidence = (old_confidence * (times_detected - 1) + confidence) / times_detected
-                
-                cursor.execute("""
-                    UPDATE patterns
-                    SET entities = ?, data = ?, confidence = ?, times_detected = ?,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                """, (
-                    json.dumps(entities), 
-                    json.dumps(data), 
-                    new_confidence, 
-                    times_detected,
-                    pattern_id
-                ))
-            else:
-                # Insert new pattern
-                cursor.execute("""
-                    INSERT INTO patterns
-                    (name, pattern_type, entities, data, confidence, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                """, (
-                    name, 
-                    pattern_type, 
-                    json.dumps(entities), 
-                    json.dumps(data), 
-                    confidence
-                ))
-                
-                # Get the ID of the inserted pattern
-                cursor.execute("SELECT last_insert_rowid()")
-                pattern_id = cursor.fetchone()[0]
+            cursor.execute(_UPSERT_PATTERN + " RETURNING id", (
+                name, 
+                pattern_type, 
+                _dumps(entities), 
+                _dumps(data), 
+                confidence
+            ))
+            pattern_id = cursor.fetchone()["id"]
             
             self.db_connection.commit()
             return pattern_id
@@ -797,8 +1080,53 @@ class DatabaseService:
         finally:
             cursor.close()
     
-    def get_patterns(self, pattern_type: Optional[str] = None, min_confidence: float = 0.0) -> List[Dict[str, Any]]:
-        """Get patterns with optional filtering."""
+    def save_patterns_bulk(self, patterns: List[Dict[str, Any]]) -> bool:
+        """
+        Save many detected patterns in one transaction.
+        
+        Args:
+            patterns: Dicts with name, pattern_type, entities, data and
+                optionally confidence, as for save_pattern
+            
+        Returns:
+            bool: Success status
+        """
+        if not patterns:
+            return True
+        
+        cursor = self.db_connection.cursor()
+        
+        try:
+            cursor.executemany(_UPSERT_PATTERN, [
+                (
+                    pattern["name"],
+                    pattern["pattern_type"],
+                    _dumps(pattern["entities"]),
+                    _dumps(pattern["data"]),
+                    pattern.get("confidence", 0.0)
+                )
+                for pattern in patterns
+            ])
+            
+            self.db_connection.commit()
+            return True
+        
+        except Exception as e:
+            logger.error(f"Error saving {len(patterns)} patterns: {str(e)}")
+            self.db_connection.rollback()
+            return False
+        
+        finally:
+            cursor.close()
+    
+    def get_patterns(self, pattern_type: Optional[str] = None, min_confidence: float = 0.0,
+                     limit: Optional[int] = None, after_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Get patterns with optional filtering.
+        
+        Passing limit and/or after_id switches to keyset pagination: rows come
+        ordered by id, starting after after_id (the last id of the previous page).
+        """
         cursor = self.db_connection.cursor()
         
         try:
@@ -810,7 +1138,7 @@ class DatabaseService:
                 query += " AND pattern_type = ?"
                 params.append(pattern_type)
             
-            query += " ORDER BY confidence DESC"
+            query = self._paginate(query, params, "confidence DESC", limit, after_id)
             
             # Execute query
             cursor.execute(query, params)
@@ -819,9 +1147,9 @@ class DatabaseService:
             patterns = []
             for row in cursor.fetchall():
                 try:
-                    entities = json.loads(row["entities"]) if row["entities"] else []
-                    data = json.loads(row["data"]) if row["data"] else {}
-                except json.JSONDecodeError:
+                    entities = orjson.loads(row["entities"]) if row["entities"] else []
+                    data = orjson.loads(row["data"]) if row["data"] else {}
+                except orjson.JSONDecodeError:
                     entities, data = [], {}
                 
                 patterns.append({
@@ -845,8 +1173,31 @@ class DatabaseService:
         finally:
             cursor.close()
     
+    @staticmethod
+    def _paginate(query: str, params: List[Any], order_by: str,
+                  limit: Optional[int], after_id: Optional[int]) -> str:
+        """Add the ORDER BY, plus keyset pagination on id when a page was requested."""
+        if limit is None and after_id is None:
+            return f"{query} ORDER BY {order_by}"
+        
+        if after_id is not None:
+            query += " AND id > ?"
+            params.append(after_id)
+        
+        query += " ORDER BY id"
+        
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        
+        return query
+    
     def _hash_token(self, token: str) -> str:
         """Create a secure hash of a token."""
         salt = secrets.token_hex(16)
-        token_hash = hashlib.sha256((token + salt).encode()).hexdigest()
-        return f"{salt}:{token_hash}"
\ No newline at end of file
+        return f"blake2b:{salt}:{self._token_digest(token, salt)}"
+    
+    @staticmethod
+    def _token_digest(token: str, salt: str) -> str:
+        """Salted BLAKE2b digest of a token; much cheaper than SHA-256 on ARM."""
+        return hashlib.blake2b(token.encode(), digest_size=32, salt=bytes.fromhex(salt)).hexdigest()
\ No newline at end of file
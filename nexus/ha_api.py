@@ -3,7 +3,7 @@ Home Assistant API client for Nexus AI
 """
 import os
 import logging
-import json
+import orjson
 import asyncio
 from typing import Dict, List, Optional, Any, Callable
 from datetime import datetime
@@ -34,7 +34,10 @@ class HomeAssistantAPI:
     async def _get_session(self):
         """Get or create the HTTP session."""
         if self._session is None or self._session.closed:
-            self._session = ClientSession()
+            # One keep-alive pool for every REST call and the WebSocket
+            self._session = ClientSession(connector=aiohttp.TCPConnector(
+                limit=100, limit_per_host=30, keepalive_timeout=60, ttl_dns_cache=300
+            ))
         return self._session
     
     def _get_headers(self):
@@ -115,29 +118,30 @@ class HomeAssistantAPI:
                 logger.info("Connecting to Home Assistant WebSocket API...")
                 self._connection_state = "connecting"
                 
-                async with aiohttp.ClientSession() as session:
-                    ws_url = f"{self.ha_url.replace('http', 'ws')}/api/websocket"
+                # Share the REST session's pool instead of opening a new one per connect
+                session = await self._get_session()
+                ws_url = f"{self.ha_url.replace('http', 'ws')}/api/websocket"
+                
+                async with session.ws_connect(ws_url) as ws:
+                    self._ws_client = ws
+                    logger.info("Connected to Home Assistant WebSocket")
                     
-                    async with session.ws_connect(ws_url) as ws:
-                        self._ws_client = ws
-                        logger.info("Connected to Home Assistant WebSocket")
-                        
-                        # Handle authentication
-                        auth_ok = await self._authenticate_websocket()
-                        if not auth_ok:
-                            logger.error("WebSocket authentication failed")
-                            self._connection_state = "auth_failed"
-                            break
-                        
-                        # Successfully connected and authenticated
-                        self._connection_state = "connected"
-                        retries = 0  # Reset retry counter on successful connection
-                        
-                        # Subscribe to state_changed events
-                        await self.subscribe_to_events("state_changed")
-                        
-                        # Start listening for events
-                        await self._listen_for_events()
+                    # Handle authentication
+                    auth_ok = await self._authenticate_websocket()
+                    if not auth_ok:
+                        logger.error("WebSocket authentication failed")
+                        self._connection_state = "auth_failed"
+                        break
+                    
+                    # Successfully connected and authenticated
+                    self._connection_state = "connected"
+                    retries = 0  # Reset retry counter on successful connection
+                    
+                    # Subscribe to state_changed events
+                    await self.subscribe_to_events("state_changed")
+                    
+                    # Start listening for events
+                    await self._listen_for_events()
             
             except (aiohttp.ClientError, asyncio.TimeoutError) as e:
                 retries += 1
@@ -192,7 +196,7 @@ class HomeAssistantAPI:
         try:
             async for msg in self._ws_client:
                 if msg.type == aiohttp.WSMsgType.TEXT:
-                    data = json.loads(msg.data)
+                    data = orjson.loads(msg.data)
                     if data.get("type") == "event":
                         event_data = data.get("event", {})
                         event_type = event_data.get("event_type")
@@ -14,6 +14,22 @@ from openai import OpenAI
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Static part of the system prompt; per-request context is appended after it
+# so the shared prefix stays cacheable on OpenAI's side
+_SYSTEM_PROMPT = """
+You are Nexus AI, an intelligent assistant for home automation integrated with Home Assistant.
+
+Your capabilities include:
+1. Answering questions about the home state
+2. Controlling home automation devices (lights, switches, etc.)
+3. Creating and suggesting automations
+4. Detecting patterns in home usage
+5. Learning preferences and remembering important information
+
+Respond in a helpful, friendly, and concise manner. When asked to control devices or create
+automations, be specific about what actions you're taking.
+"""
+
 class OpenAIHelper:
     """Helper class for OpenAI API interactions."""
     
@@ -50,19 +66,7 @@ class OpenAIHelper:
     
     def _build_system_prompt(self, context: Optional[Dict[str, Any]] = None) -> str:
         """Build a system prompt with context information."""
-        system_prompt = """
-        You are Nexus AI, an intelligent assistant for home automation integrated with Home Assistant.
-        
-        Your capabilities include:
-        1. Answering questions about the home state
-        2. Controlling home automation devices (lights, switches, etc.)
-        3. Creating and suggesting automations
-        4. Detecting patterns in home usage
-        5. Learning preferences and remembering important information
-        
-        Respond in a helpful, friendly, and concise manner. When asked to control devices or create
-        automations, be specific about what actions you're taking.
-        """
+        system_prompt = _SYSTEM_PROMPT
         
         # Add context information if available
         if context: